@@ -0,0 +1,289 @@
+"""A simulator that advances many games of the simplified Dominion in
+dominion.py in lockstep. Every pile of every game is a row of card counts in
+a NumPy array, and each step makes one decision in every unfinished game
+using vectorised legal action masks.
+
+Agents for the batch simulator implement choose_batch, which receives the
+indices of the games in which the agent is to act and their legal action
+masks, and returns an action code for each of them. Action codes index
+batch_dominion.actions, which uses the same action tuples as the engine."""
+import sys
+import time
+
+import numpy as np
+
+from dominion import DominionStats, render_observation
+from fast_dominion import (card_count, card_coins, card_costs, card_vp,
+                           treasure_ids, play_actions, buy_actions, END_TURN,
+                           initial_player_counts, initial_supply, province_id)
+from observation import Observation, EventType
+
+actions = ([play_actions[card_id] for card_id in treasure_ids]
+           + buy_actions
+           + [END_TURN])
+
+action_count = len(actions)
+
+FIRST_BUY = len(treasure_ids)
+END_TURN_CODE = action_count - 1
+
+_play_cards = np.array(treasure_ids)
+_coins = np.array(card_coins)
+_costs = np.array(card_costs)
+_vp = np.array(card_vp)
+
+NO_EVENT, START_TURN, PLAY, BUY = 0, 1, 2, 3
+
+_event_types = {
+    START_TURN: EventType.start_turn,
+    PLAY: EventType.play,
+    BUY: EventType.buy,
+}
+
+
+class RandomBatchAgent:
+    """Chooses uniformly among the legal actions, like player.RandomPlayer"""
+    def choose_batch(self, simulator, games, legal, rng):
+        return _uniform_among(legal, rng)
+
+
+class GreedyBatchAgent:
+    """Acts greedily according to a frozen Q estimator, like a
+    policy.Greedy policy inside an AgentWithLatestObservationAsState agent,
+    exploring uniformly at random with probability epsilon.
+
+    The state is the projection of the latest observation, so the Q values
+    of all actions are computed once per distinct latest observation and
+    then looked up for every game in which it is the latest one.
+
+    Estimators with a snapshot method are evaluated through a snapshot, so
+    that predicting does not add entries for unseen pairs to them."""
+    def __init__(self, estimator, projection, epsilon=0.0):
+        snapshot = getattr(estimator, 'snapshot', None)
+        self._estimator = snapshot() if snapshot else estimator
+        self._projection = projection
+        self._epsilon = epsilon
+        self._q_rows = {}
+
+    def choose_batch(self, simulator, games, legal, rng):
+        q_rows = self._q_rows
+        rows = []
+        for key in simulator.latest_observation_keys(games):
+            row = q_rows.get(key)
+            if row is None:
+                row = q_rows[key] = self._q_row(simulator, key)
+            rows.append(row)
+        values = np.where(legal, np.array(rows), -np.inf)
+        chosen = values.argmax(axis=1)
+        if self._epsilon:
+            explore = rng.random(len(games)) < self._epsilon
+            chosen[explore] = _uniform_among(legal[explore], rng)
+        return chosen
+
+    def _q_row(self, simulator, key):
+        observation, private = simulator.observation_for_key(key)
+        project_event = getattr(self._projection, 'project_event', None)
+        if observation is None:
+            state = ()
+        elif project_event:
+            state = project_event(observation, private)
+        else:
+            state = self._projection(render_observation(observation, private))
+        return np.asarray(self._estimator.predict_many(state, actions),
+                          dtype=np.float64)
+
+
+def _uniform_among(legal, rng):
+    picks = (rng.random(len(legal)) * legal.sum(axis=1)).astype(np.int64)
+    return (legal.cumsum(axis=1) > picks[:, None]).argmax(axis=1)
+
+
+class BatchSimulator:
+    """Plays the given number of games between the batch agents, given
+    as a dict from player name to agent. Seating is shuffled per game."""
+    def __init__(self, agents, games, seed=None):
+        self._names = list(agents.keys())
+        self._agents = list(agents.values())
+        self._rng = np.random.default_rng(seed)
+        self._games = games
+        players = len(self._agents)
+        shape = (games, players, card_count)
+        self._deck = np.tile(np.array(initial_player_counts),
+                             (games, players, 1))
+        self._hand = np.zeros(shape, dtype=np.int64)
+        self._played = np.zeros(shape, dtype=np.int64)
+        self._discard = np.zeros(shape, dtype=np.int64)
+        self._supply = np.tile(np.array(initial_supply), (games, 1))
+        self._spend = np.zeros(games, dtype=np.int64)
+        self._buys = np.ones(games, dtype=np.int64)
+        self._turn = np.ones(games, dtype=np.int64)
+        self._active = np.zeros(games, dtype=np.int64)
+        self._over = np.zeros(games, dtype=bool)
+        self._seat_agent = self._rng.permuted(
+            np.tile(np.arange(players), (games, 1)), axis=1)
+        self._event_type = np.full(games, NO_EVENT, dtype=np.int64)
+        self._event_actor = np.zeros(games, dtype=np.int64)
+        self._event_card = np.zeros(games, dtype=np.int64)
+        self._event_coins = np.zeros(games, dtype=np.int64)
+        self._event_turn = np.zeros(games, dtype=np.int64)
+        self.decisions = 0
+        all_games = np.arange(games)
+        for seat in range(players):
+            self._draw(all_games, np.full(games, seat), 5)
+        self._set_event(all_games, START_TURN, self._active, 0, 0, self._turn)
+
+    def run(self):
+        """Play all games to the end and return their DominionStats"""
+        live = np.flatnonzero(~self._over)
+        while len(live):
+            self.step(live)
+            live = live[~self._over[live]]
+        return self.get_stats()
+
+    def step(self, games):
+        legal = self._legal_actions(games)
+        agent_at = self._seat_agent[games, self._active[games]]
+        codes = np.empty(len(games), dtype=np.int64)
+        for agent_idx, agent in enumerate(self._agents):
+            mine = agent_at == agent_idx
+            if mine.any():
+                codes[mine] = agent.choose_batch(
+                    self, games[mine], legal[mine], self._rng)
+        self._apply(games, codes)
+        self.decisions += len(games)
+        supply = self._supply[games]
+        self._over[games] = ((supply[:, province_id] == 0)
+                             | ((supply == 0).sum(axis=1) >= 3))
+
+    def latest_observation_keys(self, games):
+        """Hashable descriptions of the latest observation in each of the
+        games, as seen by the player who is about to act"""
+        return zip(self._event_type[games].tolist(),
+                   self._seat_agent[games, self._event_actor[games]].tolist(),
+                   (self._event_actor[games] == self._active[games]).tolist(),
+                   self._event_card[games].tolist(),
+                   self._event_coins[games].tolist(),
+                   self._event_turn[games].tolist())
+
+    def observation_for_key(self, key):
+        """The observation record and privacy flag described by a key
+        returned from latest_observation_keys"""
+        event_type, actor, private, card, coins, turn = key
+        if event_type == NO_EVENT:
+            return None, private
+        actor_name = self._names[actor]
+        if event_type == START_TURN:
+            observation = Observation(
+                EventType.start_turn, actor_name, None, None, turn)
+        elif event_type == PLAY:
+            observation = Observation(
+                EventType.play, actor_name, card, coins, None)
+        else:
+            observation = Observation(
+                EventType.buy, actor_name, card, None, None)
+        return observation, private
+
+    def get_stats(self):
+        all_cards = self._deck + self._hand + self._played + self._discard
+        points = (all_cards * _vp).sum(axis=2)
+        winning_seats = points.argmax(axis=1)
+        games = np.arange(self._games)
+        winners = self._seat_agent[games, winning_seats]
+        return [DominionStats(winner=self._names[winner],
+                              turns=int(turns),
+                              score=int(score))
+                for winner, turns, score
+                in zip(winners,
+                       self._turn,
+                       points[games, winning_seats])]
+
+    def _legal_actions(self, games):
+        seats = self._active[games]
+        hand = self._hand[games, seats]
+        legal = np.zeros((len(games), action_count), dtype=bool)
+        legal[:, :FIRST_BUY] = hand[:, _play_cards] > 0
+        legal[:, FIRST_BUY:END_TURN_CODE] = (
+            (self._supply[games] > 0)
+            & (_costs[None, :] <= self._spend[games, None])
+            & (self._buys[games, None] > 0))
+        legal[:, END_TURN_CODE] = True
+        return legal
+
+    def _apply(self, games, codes):
+        seats = self._active[games]
+        play = codes < FIRST_BUY
+        if play.any():
+            g, s = games[play], seats[play]
+            cards = _play_cards[codes[play]]
+            self._hand[g, s, cards] -= 1
+            self._played[g, s, cards] += 1
+            self._spend[g] += _coins[cards]
+            self._set_event(g, PLAY, s, cards, self._spend[g], 0)
+        buy = (codes >= FIRST_BUY) & (codes < END_TURN_CODE)
+        if buy.any():
+            g, s = games[buy], seats[buy]
+            cards = codes[buy] - FIRST_BUY
+            self._supply[g, cards] -= 1
+            self._discard[g, s, cards] += 1
+            self._spend[g] -= _costs[cards]
+            self._buys[g] -= 1
+            self._set_event(g, BUY, s, cards, 0, 0)
+        ending = (codes == END_TURN_CODE) | (buy & (self._buys[games] == 0))
+        if ending.any():
+            self._cleanup_and_next_player(games[ending])
+
+    def _cleanup_and_next_player(self, games):
+        seats = self._active[games]
+        self._discard[games, seats] += (self._hand[games, seats]
+                                        + self._played[games, seats])
+        self._hand[games, seats] = 0
+        self._played[games, seats] = 0
+        self._draw(games, seats, 5)
+        next_seats = seats + 1
+        wrapped = next_seats >= len(self._agents)
+        next_seats[wrapped] = 0
+        self._turn[games[wrapped]] += 1
+        self._active[games] = next_seats
+        self._spend[games] = 0
+        self._buys[games] = 1
+        self._set_event(games, START_TURN, next_seats, 0, 0, self._turn[games])
+
+    def _draw(self, games, seats, count):
+        for _ in range(count):
+            deck = self._deck[games, seats]
+            sizes = deck.sum(axis=1)
+            empty = sizes == 0
+            if empty.any():
+                g, s = games[empty], seats[empty]
+                self._deck[g, s] = self._discard[g, s]
+                self._discard[g, s] = 0
+                deck = self._deck[games, seats]
+                sizes = deck.sum(axis=1)
+            picks = (self._rng.random(len(games)) * sizes).astype(np.int64)
+            drawn = (deck.cumsum(axis=1) > picks[:, None]).argmax(axis=1)
+            has_cards = sizes > 0
+            g, s = games[has_cards], seats[has_cards]
+            self._deck[g, s, drawn[has_cards]] -= 1
+            self._hand[g, s, drawn[has_cards]] += 1
+
+    def _set_event(self, games, event_type, actors, cards, coins, turns):
+        self._event_type[games] = event_type
+        self._event_actor[games] = actors
+        self._event_card[games] = cards
+        self._event_coins[games] = coins
+        self._event_turn[games] = turns
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    start = time.time()
+    simulator = BatchSimulator(
+        {'random': RandomBatchAgent(), 'beta-ai': RandomBatchAgent()},
+        games, seed=0)
+    stats = simulator.run()
+    elapsed = time.time() - start
+    print('{} games, {} decisions in {:.2f}s ({:.0f} games/s)'.format(
+        games, simulator.decisions, elapsed, games / elapsed))
+    print('average turns = {}'.format(np.mean([s.turns for s in stats])))
+    print('average winning score = {}'.format(
+        np.mean([s.score for s in stats])))
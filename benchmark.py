@@ -0,0 +1,314 @@
+"""Throughput benchmarks for the engines, agents and learning loop.
+
+    python benchmark.py [output.json]
+    python benchmark.py compare old.json new.json
+
+Every benchmark is seeded, so consecutive runs on the same machine do the
+same work. Results are written as JSON, by default to
+results/benchmark-<timestamp>.json."""
+from contextlib import redirect_stdout
+from datetime import datetime
+import io
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import dominion
+import fast_dominion
+from batch_dominion import BatchSimulator, RandomBatchAgent, GreedyBatchAgent
+from dominion import ignore_player_and_turn_projection, render_observation
+from estimators import (TabularQEstimator, ArrayTabularQEstimator,
+                        BoundedTabularQEstimator)
+from game import Game
+from learn import mc_evaluate
+from player import RandomPlayer, AgentWithLatestObservationAsState
+from policy import Greedy, EpsilonSoft
+
+SEED = 20180729
+
+
+class _CountingGame(Game):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decisions = 0
+
+    def _next_choice(self, observations, choice):
+        self.decisions += 1
+        return super()._next_choice(observations, choice)
+
+
+def _trained_estimator(games=500):
+    random.seed(SEED)
+    estimator = TabularQEstimator()
+    with redirect_stdout(io.StringIO()):
+        mc_evaluate([estimator],
+                    EpsilonSoft(0.1, Greedy(estimator)),
+                    RandomPlayer(),
+                    games=games,
+                    games_between_stats=games)
+    return estimator
+
+
+def bench_game_play(make_players, games, engine=dominion):
+    random.seed(SEED)
+    decisions = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        game = _CountingGame(make_players(), engine=engine)
+        game.play()
+        decisions += game.decisions
+    elapsed = time.perf_counter() - start
+    return {
+        'games': games,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed,
+        'decisions_per_second': decisions / elapsed,
+    }
+
+
+def bench_get_next_choice(engine, games):
+    random.seed(SEED)
+    calls = 0
+    elapsed = 0.0
+    for _ in range(games):
+        state = engine.GameState(['alice', 'bob'])
+        _, choice = state.get_first_choice()
+        while not state.is_game_over():
+            chosen = choice.alternatives[
+                random.randrange(len(choice.alternatives))]
+            start = time.perf_counter()
+            _, choice = state.get_next_choice(chosen)
+            elapsed += time.perf_counter() - start
+            calls += 1
+    return {
+        'calls': calls,
+        'microseconds_per_call': 1e6 * elapsed / calls,
+    }
+
+
+def bench_clone(games=20):
+    rng = random.Random(SEED)
+    clones = 0
+    elapsed = {'clone_us': 0.0, 'determinized_clone_us': 0.0}
+    for _ in range(games):
+        state = fast_dominion.GameState(['alice', 'bob'],
+                                        random.Random(rng.random()))
+        _, choice = state.get_first_choice()
+        while not state.is_game_over():
+            start = time.perf_counter()
+            state.clone()
+            cloned = time.perf_counter()
+            state.clone(determinize_for=choice.player)
+            elapsed['clone_us'] += cloned - start
+            elapsed['determinized_clone_us'] += time.perf_counter() - cloned
+            clones += 1
+            _, choice = state.get_next_choice(choice.alternatives[
+                rng.randrange(len(choice.alternatives))])
+    return dict({key: 1e6 * seconds / clones
+                 for key, seconds in elapsed.items()},
+                clones=clones)
+
+
+def _sample_observations(games=5):
+    random.seed(SEED)
+    observations = []
+    for _ in range(games):
+        state = dominion.GameState(['epsilon', 'random'])
+        new_observations, choice = state.get_first_choice()
+        observations.extend(new_observations)
+        while not state.is_game_over():
+            chosen = choice.alternatives[
+                random.randrange(len(choice.alternatives))]
+            new_observations, choice = state.get_next_choice(chosen)
+            observations.extend(new_observations)
+    return [(observation, observation.actor == 'epsilon')
+            for observation in observations]
+
+
+def bench_projection():
+    events = _sample_observations()
+    texts = [render_observation(observation, private)
+             for observation, private in events]
+    uncached = ignore_player_and_turn_projection._projection
+
+    def per_call(function, inputs):
+        start = time.perf_counter()
+        for value in inputs:
+            function(*value)
+        return 1e6 * (time.perf_counter() - start) / len(inputs)
+
+    ignore_player_and_turn_projection.clear()
+    return {
+        'observations': len(events),
+        'render_us': per_call(render_observation, events),
+        'regex_text_us': per_call(uncached, [(text,) for text in texts]),
+        'memoized_text_us': per_call(ignore_player_and_turn_projection,
+                                     [(text,) for text in texts]),
+        'memoized_event_us': per_call(
+            ignore_player_and_turn_projection.project_event, events),
+        'cache': ignore_player_and_turn_projection.cache_info(),
+    }
+
+
+def bench_estimator(estimator_class, entries, operations=20000):
+    rng = random.Random(SEED)
+    states = ['state {}'.format(i) for i in range(max(1, entries // 10))]
+    actions = [(dominion.ChoiceType.buy, 'action {}'.format(i))
+               for i in range(10)]
+    estimator = estimator_class()
+    for S in states:
+        for A in actions:
+            estimator.learnFrom(S, A, rng.choice((-1, 1)))
+    queries = [(rng.choice(states), rng.choice(actions))
+               for _ in range(operations)]
+    start = time.perf_counter()
+    for S, A in queries:
+        estimator.predict(S, A)
+    predict = time.perf_counter() - start
+    start = time.perf_counter()
+    for S, A in queries:
+        estimator.learnFrom(S, A, 1)
+    learn = time.perf_counter() - start
+    start = time.perf_counter()
+    for S, _ in queries[:operations // 10]:
+        estimator.predict_many(S, actions)
+    predict_many = time.perf_counter() - start
+    return {
+        'entries': len(states) * len(actions),
+        'predict_us': 1e6 * predict / operations,
+        'learnFrom_us': 1e6 * learn / operations,
+        'predict_many_10_us': 1e6 * predict_many / (operations // 10),
+    }
+
+
+def bench_mc_evaluate(games):
+    random.seed(SEED)
+    estimator = TabularQEstimator()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        mc_evaluate([estimator],
+                    EpsilonSoft(0.1, Greedy(estimator)),
+                    RandomPlayer(),
+                    games=games,
+                    games_between_stats=games)
+    elapsed = time.perf_counter() - start
+    return {
+        'games': games,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed,
+        'table_size': len(estimator._q_estimates),
+    }
+
+
+def bench_batch_simulator(make_agents, games):
+    start = time.perf_counter()
+    simulator = BatchSimulator(make_agents(), games, seed=SEED)
+    simulator.run()
+    elapsed = time.perf_counter() - start
+    return {
+        'games': games,
+        'seconds': elapsed,
+        'games_per_second': games / elapsed,
+        'decisions_per_second': simulator.decisions / elapsed,
+    }
+
+
+def run_benchmarks():
+    estimator = _trained_estimator()
+
+    def random_vs_random():
+        return {'random': RandomPlayer(), 'beta-ai': RandomPlayer()}
+
+    def greedy_vs_random():
+        return {
+            'epsilon': AgentWithLatestObservationAsState(
+                Greedy(estimator), ignore_player_and_turn_projection),
+            'random': RandomPlayer(),
+        }
+
+    return {
+        'game_play': {
+            'random_vs_random': bench_game_play(random_vs_random, 50),
+            'greedy_vs_random': bench_game_play(greedy_vs_random, 200),
+            'random_vs_random_fast_engine': bench_game_play(
+                random_vs_random, 50, engine=fast_dominion),
+            'greedy_vs_random_fast_engine': bench_game_play(
+                greedy_vs_random, 200, engine=fast_dominion),
+        },
+        'get_next_choice': {
+            'dominion': bench_get_next_choice(dominion, 20),
+            'fast_dominion': bench_get_next_choice(fast_dominion, 20),
+        },
+        'clone': bench_clone(),
+        'projection': bench_projection(),
+        'estimators': {
+            estimator_class.__name__: [
+                bench_estimator(estimator_class, entries)
+                for entries in (1000, 10000, 100000)]
+            for estimator_class
+            in (TabularQEstimator, ArrayTabularQEstimator,
+                BoundedTabularQEstimator)},
+        'mc_evaluate': bench_mc_evaluate(200),
+        'batch_simulator': {
+            'random_vs_random': bench_batch_simulator(
+                lambda: {'random': RandomBatchAgent(),
+                         'beta-ai': RandomBatchAgent()},
+                2000),
+            'greedy_vs_random': bench_batch_simulator(
+                lambda: {'epsilon': GreedyBatchAgent(
+                            estimator, ignore_player_and_turn_projection),
+                         'random': RandomBatchAgent()},
+                2000),
+        },
+    }
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(_flatten(value, prefix + key + '.'))
+    elif isinstance(results, list):
+        for i, value in enumerate(results):
+            flat.update(_flatten(value, prefix + str(i) + '.'))
+    elif isinstance(results, (int, float)):
+        flat[prefix[:-1]] = results
+    return flat
+
+
+def compare(old_path, new_path):
+    """Print the ratio new / old of every metric in two result files"""
+    with open(old_path) as file:
+        old = _flatten(json.load(file)['results'])
+    with open(new_path) as file:
+        new = _flatten(json.load(file)['results'])
+    for key in sorted(old.keys() & new.keys()):
+        if old[key]:
+            print('{:70s} {:12.3f} {:12.3f} {:8.2f}x'.format(
+                key, old[key], new[key], new[key] / old[key]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+        sys.exit()
+    now = datetime.now().replace(microsecond=0)
+    if len(sys.argv) > 1:
+        output = sys.argv[1]
+    else:
+        output = 'results/benchmark-' + now.isoformat() + '.json'
+    np.random.seed(SEED)
+    report = {
+        'timestamp': now.isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'results': run_benchmarks(),
+    }
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report['results'], indent=2))
@@ -1,20 +1,14 @@
 from enum import Enum
 from collections import namedtuple
 import random
-import re
 
 from choice import Choice
-from observation import Observation
+from observation import Observation, EventType
+from projection import MemoizedProjection, RegexProjection
+from rules import (Card, CardType, EffectType, Effect, ChoiceType,
+                   CardTables, SupplyIndex)
 
-Card = namedtuple('card', 'name type cost effects vp')
-
-CardType = Enum('CardType', 'treasure victory')
-
-EffectType = Enum('EffectType', 'coins')
-
-Effect = namedtuple('effect', 'type value')
-
-cards = [
+base_cards = [
     Card('copper', CardType.treasure, 0, [Effect(EffectType.coins, 1)], 0),
     Card('silver', CardType.treasure, 3, [Effect(EffectType.coins, 2)], 0),
     Card('gold', CardType.treasure, 6, [Effect(EffectType.coins, 3)], 0),
@@ -23,26 +17,71 @@ cards = [
     Card('province', CardType.victory, 8, [], 6)
 ]
 
+kingdom_cards = [
+    Card('village', CardType.action, 3,
+         [Effect(EffectType.cards, 1), Effect(EffectType.actions, 2)], 0),
+    Card('woodcutter', CardType.action, 3,
+         [Effect(EffectType.buys, 1), Effect(EffectType.coins, 2)], 0),
+    Card('smithy', CardType.action, 4, [Effect(EffectType.cards, 3)], 0),
+    Card('festival', CardType.action, 5,
+         [Effect(EffectType.actions, 2),
+          Effect(EffectType.buys, 1),
+          Effect(EffectType.coins, 2)], 0),
+    Card('laboratory', CardType.action, 5,
+         [Effect(EffectType.cards, 2), Effect(EffectType.actions, 1)], 0),
+    Card('market', CardType.action, 5,
+         [Effect(EffectType.cards, 1),
+          Effect(EffectType.actions, 1),
+          Effect(EffectType.buys, 1),
+          Effect(EffectType.coins, 1)], 0),
+]
+
+cards = base_cards + kingdom_cards
+
 card_by_name = {card.name: card for card in cards}
 
+card_ids = {card.name: i for i, card in enumerate(cards)}
+
+card_tables = CardTables(cards)
+
+base_supply = [('copper', 60), ('silver', 40), ('gold', 30),
+               ('estate', 8), ('duchy', 8), ('province', 8)]
+
+kingdom_pile_size = 10
+
+_supply_indices = {}
+
+
+def supply_index(kingdom=()):
+    """The compiled SupplyIndex of a game with the given kingdom cards"""
+    kingdom = tuple(kingdom)
+    index = _supply_indices.get(kingdom)
+    if index is None:
+        index = _supply_indices[kingdom] = SupplyIndex(
+            card_tables,
+            [card_ids[name] for name, _ in base_supply]
+            + [card_ids[name] for name in kingdom])
+    return index
+
 initial_player_cards = (
     [card_by_name['copper']] * 7
     + [card_by_name['estate']] * 3)
 
 GameStep = Enum('GameStep', 'action buy cleanup')
 
-ChoiceType = Enum('ChoiceType', 'buy play end_turn')
+treasure_modes = ('manual', 'auto', 'macro')
 
 
-def initial_player_deck():
-    return random.sample(initial_player_cards, len(initial_player_cards))
+def initial_player_deck(rng=random):
+    return rng.sample(initial_player_cards, len(initial_player_cards))
 
 
 class PlayerState:
-    def __init__(self, name, observation_buffer):
+    def __init__(self, name, observation_buffer, rng=random):
         self._name = name
         self._observations = observation_buffer
-        self._deck = initial_player_deck()
+        self._rng = rng
+        self._deck = initial_player_deck(rng)
         self._hand = []
         self._played = []
         self._discard = []
@@ -64,7 +103,7 @@ class PlayerState:
         if not self._deck:
             self._deck = self._discard
             self._discard = []
-            random.shuffle(self._deck)
+            self._rng.shuffle(self._deck)
         if self._deck:
             drawn_card = self._deck.pop()
             self._hand.append(drawn_card)
@@ -75,9 +114,13 @@ class PlayerState:
         self._discard_played()
         self._draw_hand()
 
+    def get_actions(self):
+        return self._actions
+
     def start_turn(self, turn_number):
         self._to_spend = 0
         self._buys = 1
+        self._actions = 1
         self._start_turn_observed(turn_number)
 
     def buy(self, card):
@@ -93,14 +136,19 @@ class PlayerState:
         # this should always find a card.
         # Crash with uncaught StopIteration exception if not
         card = next(card for card in self._hand if card.name == card_name)
+        card_id = card_ids[card_name]
+        if card_tables.is_action[card_id]:
+            assert self._actions, "Played an action when no actions left"
+            self._actions -= 1
         self._hand.remove(card)
         self._played.append(card)
-        for effect in card.effects:
-            if effect.type == EffectType.coins:
-                self._to_spend += effect.value
-        # TODO the timing of this observation will need to change again when
-        # complex effects are introduced
+        effects = card_tables.effects[card_id]
+        self._to_spend += effects.coins
+        self._actions += effects.actions
+        self._buys += effects.buys
         self._play_card_observed(card)
+        for _ in range(effects.cards):
+            self.draw()
 
     def gain(self, card):
         self._discard.append(card)
@@ -127,53 +175,67 @@ class PlayerState:
         self._observations.append(observation)
 
     def _start_turn_observed(self, turn_number):
-        message = "turn {} starts for {}".format(turn_number, self._name)
-        self._observation(Observation(self._name, message, message))
+        self._observation(Observation(
+            EventType.start_turn, self._name, None, None, turn_number))
 
     def _play_card_observed(self, card):
-        message = "{} plays {} and now has {} coins to spend".format(
-            self._name,
-            card.name,
-            self._to_spend)
-        self._observation(Observation(self._name, message, message))
+        self._observation(Observation(
+            EventType.play, self._name, card_ids[card.name], self._to_spend,
+            None))
 
     def _buy_card_observed(self, card):
-        message = "{} buys {}".format(self._name, card.name)
-        self._observation(Observation(self._name, message, message))
+        self._observation(Observation(
+            EventType.buy, self._name, card_ids[card.name], None, None))
 
     def _draw_card_observed(self, card):
-        private = "{} draws {}".format(self._name, card.name)
-        public = "{} draws a card".format(self._name)
-        self._observation(Observation(self._name, private, public))
+        self._observation(Observation(
+            EventType.draw, self._name, card_ids[card.name], None, None))
 
 
 DominionStats = namedtuple('DominionStats', 'winner turns score')
 
 
 class GameState:
-    def __init__(self, players):
+    """With treasures='manual', playing each treasure is a decision of its
+    own. With 'auto', all treasures in hand are played at the start of each
+    decision, and with 'macro' the choice to play them all is offered as
+    the single action (ChoiceType.play_treasures,). Either way treasures
+    are played in the order of the cards list. If skip_forced is set,
+    decisions with a single alternative are made automatically.
+
+    The supply holds the base cards and a pile of each of the kingdom
+    cards named in kingdom. Action cards can be played at any time during
+    a turn, as long as the player has actions left."""
+    def __init__(self, players, rng=random, treasures='manual',
+                 skip_forced=False, kingdom=()):
+        if treasures not in treasure_modes:
+            raise ValueError('Unknown treasure mode: {}'.format(treasures))
+        self._treasures = treasures
+        self._skip_forced = skip_forced
         self._observations = []
         self._published_observations = 0
         self._turn = 1
-        self._players = [PlayerState(player, self._observations)
+        self._players = [PlayerState(player, self._observations, rng)
                          for player in players]
+        self._supply_index = supply_index(kingdom)
         self._supply = {
-            'copper': [card_by_name['copper']] * 60,
-            'silver': [card_by_name['silver']] * 40,
-            'gold': [card_by_name['gold']] * 30,
-            'estate': [card_by_name['estate']] * 8,
-            'duchy': [card_by_name['duchy']] * 8,
-            'province': [card_by_name['province']] * 8,
-        }
+            name: [card_by_name[name]] * count
+            for name, count
+            in base_supply + [(name, kingdom_pile_size) for name in kingdom]}
         self._game_step = GameStep.action
         self._active_player_idx = 0
 
     def get_first_choice(self):
         self._players[0].start_turn(self._turn)
-        return (self._publish_observations(),
-                self._purchase_or_play_treasure_choice(self._active_player()))
+        choice = self._next_decision()
+        return self._publish_observations(), choice
 
     def get_next_choice(self, chosen):
+        self._apply(chosen)
+        choice = self._next_decision()
+        return self._publish_observations(), choice
+
+    def _apply(self, chosen):
         choice_type = chosen[0]
         if choice_type == ChoiceType.buy:
             self._purchase(self._active_player(), chosen[1])
@@ -181,10 +243,29 @@ class GameState:
                 self._cleanup_and_next_player()
         elif choice_type == ChoiceType.play:
             self._active_player().play(chosen[1])
+        elif choice_type == ChoiceType.play_treasures:
+            self._play_treasures(self._active_player())
         else:
             self._cleanup_and_next_player()
-        return (self._publish_observations(),
-                self._purchase_or_play_treasure_choice(self._active_player()))
+
+    def _next_decision(self):
+        while True:
+            player = self._active_player()
+            if self._treasures == 'auto':
+                self._play_treasures(player)
+            choice = self._purchase_or_play_treasure_choice(player)
+            if (not self._skip_forced
+                    or len(choice.alternatives) > 1
+                    or self.is_game_over()):
+                return choice
+            self._apply(choice.alternatives[0])
+
+    def _play_treasures(self, player):
+        for card in sorted((card
+                            for card in player.get_hand()
+                            if card.type == CardType.treasure),
+                           key=lambda card: card_ids[card.name]):
+            player.play(card.name)
 
     def is_game_over(self):
         empty_supplies = [
@@ -205,7 +286,8 @@ class GameState:
                                     for card in own_cards
                                     if card.name == card_name])
                     for card_name
-                    in list(set(card.name for card in own_cards))}
+                    in sorted({card.name for card in own_cards},
+                              key=card_ids.get)}
                 for player, own_cards
                 in cards.items()
             }
@@ -225,6 +307,12 @@ class GameState:
                 score=score
             )
 
+    def get_scores(self):
+        """The points of each player by name"""
+        return {player.get_name(): sum(card.vp
+                                       for card in player.get_all_cards())
+                for player in self._players}
+
     def get_winner(self):
         if not self.is_game_over():
             return None
@@ -247,21 +335,22 @@ class GameState:
     def _active_player(self):
         return self._players[self._active_player_idx]
 
-    def _cards_available_at(self, cost):
-        return [supplyDeck[0]
-                for supplyDeck
-                in self._supply.values()
-                if supplyDeck and supplyDeck[0].cost <= cost]
-
     def _purchase_or_play_treasure_choice(self, player):
+        index = self._supply_index
+        in_hand = {card.name for card in player.get_hand()}
+        plays = [action for _, action in index.treasure_plays
+                 if action[1] in in_hand]
+        if plays and self._treasures == 'macro':
+            plays = [(ChoiceType.play_treasures,)]
+        if player.get_actions():
+            plays += [action for _, action in index.action_plays
+                      if action[1] in in_hand]
         return Choice(
             player.get_name(),
-            list({(ChoiceType.play, card.name)
-                  for card in player.get_hand()
-                  if card.type == CardType.treasure})
-            + [(ChoiceType.buy, card.name)
-               for card
-               in self._cards_available_at(player.get_available_spend())]
+            plays
+            + [action
+               for _, action in index.buys_at(player.get_available_spend())
+               if self._supply[action[1]]]
             + [(ChoiceType.end_turn,)])
 
     def _purchase(self, player, card_name):
@@ -283,9 +372,72 @@ class GameState:
         self._active_player().start_turn(self._turn)
 
 
-def ignore_player_and_turn_projection(state):
-    no_turn = re.sub(r'turn \d* starts', 'turn starts', state)
-    no_player_1 = re.sub(r'epsilon', '', no_turn)
-    no_player_2 = re.sub(r'random', '', no_player_1)
-    no_card = re.sub(r'plays \w* and now has', 'plays a card and now has', no_player_2)
-    return no_card
+def render_observation(observation, private):
+    """The text of an observation, as seen by the actor if private is
+    true, and by everyone else otherwise"""
+    event_type = observation.type
+    if event_type == EventType.draw:
+        if private:
+            return "{} draws {}".format(
+                observation.actor, cards[observation.card].name)
+        return "{} draws a card".format(observation.actor)
+    elif event_type == EventType.play:
+        return "{} plays {} and now has {} coins to spend".format(
+            observation.actor,
+            cards[observation.card].name,
+            observation.coins)
+    elif event_type == EventType.buy:
+        return "{} buys {}".format(
+            observation.actor, cards[observation.card].name)
+    else:
+        return "turn {} starts for {}".format(
+            observation.turn, observation.actor)
+
+
+def _without_player(name):
+    return name.replace('epsilon', '').replace('random', '')
+
+
+def _ignore_player_and_turn_event(observation, private):
+    """The text ignore_player_and_turn_projection makes of an observation,
+    made from its fields"""
+    actor = _without_player(observation.actor)
+    event_type = observation.type
+    if event_type == EventType.draw:
+        if private:
+            return "{} draws {}".format(actor, cards[observation.card].name)
+        return "{} draws a card".format(actor)
+    elif event_type == EventType.play:
+        return "{} plays a card and now has {} coins to spend".format(
+            actor, observation.coins)
+    elif event_type == EventType.buy:
+        return "{} buys {}".format(actor, cards[observation.card].name)
+    else:
+        return "turn starts for {}".format(actor)
+
+
+def _ignore_player_event(observation, private):
+    return render_observation(
+        observation._replace(actor=_without_player(observation.actor)),
+        private)
+
+
+# The regular expressions project text observations, and the event
+# projections project structured ones to the same text directly
+ignore_player_and_turn_projection = MemoizedProjection(
+    RegexProjection([
+        (r'turn \d* starts', 'turn starts'),
+        (r'epsilon', ''),
+        (r'random', ''),
+        (r'plays \w* and now has', 'plays a card and now has'),
+    ]),
+    render=render_observation,
+    event_projection=_ignore_player_and_turn_event)
+
+ignore_player_projection = MemoizedProjection(
+    RegexProjection([
+        (r'epsilon', ''),
+        (r'random', ''),
+    ]),
+    render=render_observation,
+    event_projection=_ignore_player_event)
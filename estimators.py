@@ -1,11 +1,191 @@
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
 import copy
+import heapq
+import io
+import pickle
+import random
+from types import MappingProxyType
+import zlib
+
+import numpy as np
 
 
 def default_for_s_a():
     return (0, 0)
 
 
+class QTable:
+    """A mapping from (state, action) to (n, q) that, like a defaultdict,
+    inserts (0, 0) for pairs that are looked up but missing, and keeps an
+    index from each state to the actions seen in it.
+
+    Snapshots and copies are O(1): the current entries become a frozen
+    layer shared by the snapshot and the table, and the table continues
+    writing into a fresh overlay, copying entries into it as they are
+    updated. Snapshots are read-only, and looking up missing pairs in them
+    does not insert anything.
+
+    overlay is the dict of entries written since the last snapshot. Once a
+    pair has been looked up, its entry may be assigned in overlay directly,
+    which is what the estimators do on their hot paths."""
+    max_layers = 8
+
+    def __init__(self, entries=()):
+        self.overlay = {}
+        self._actions_by_state = defaultdict(list)
+        self._set_layers(())
+        self._size = 0
+        self._frozen = False
+        for s_a, n_q in dict(entries).items():
+            self[s_a] = n_q
+
+    def __getitem__(self, s_a):
+        n_q = self.overlay.get(s_a)
+        if n_q is not None:
+            return n_q
+        for layer_entries, _ in self._lookup_layers:
+            n_q = layer_entries.get(s_a)
+            if n_q is not None:
+                return n_q
+        if self._frozen:
+            return default_for_s_a()
+        self[s_a] = default_for_s_a()
+        return self.overlay[s_a]
+
+    def __setitem__(self, s_a, n_q):
+        if self._frozen:
+            raise TypeError('Q table snapshots are read-only')
+        entries = self.overlay
+        size = len(entries)
+        entries[s_a] = n_q
+        if len(entries) != size and not self._in_layers(s_a):
+            self._actions_by_state[s_a[0]].append(s_a[1])
+            self._size += 1
+
+    def get(self, s_a, default=None):
+        n_q = self.overlay.get(s_a)
+        if n_q is not None:
+            return n_q
+        for layer_entries, _ in self._lookup_layers:
+            n_q = layer_entries.get(s_a)
+            if n_q is not None:
+                return n_q
+        return default
+
+    def __contains__(self, s_a):
+        return s_a in self.overlay or self._in_layers(s_a)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [s_a for s_a, _ in self.items()]
+
+    def items(self):
+        if not self._layers:
+            return self.overlay.items()
+        return list(self._iter_items())
+
+    def states(self):
+        if not self._layers:
+            return self._actions_by_state.keys()
+        states = {}
+        for _, actions_by_state in self._all_layers():
+            states.update(dict.fromkeys(actions_by_state))
+        return states.keys()
+
+    def actions(self, state):
+        if not self._layers:
+            return self._actions_by_state.get(state, ())
+        actions = []
+        for _, actions_by_state in self._all_layers():
+            actions.extend(actions_by_state.get(state, ()))
+        return actions
+
+    def snapshot(self):
+        """A read-only view of the table as it is now"""
+        return self._share_layers(frozen=True)
+
+    def copy(self):
+        """A writable copy of the table, sharing the current entries with
+        it until either of them updates them"""
+        return self._share_layers(frozen=False)
+
+    def _share_layers(self, frozen):
+        self._freeze_overlay()
+        shared = QTable()
+        shared._set_layers(self._layers)
+        shared._size = self._size
+        if frozen:
+            shared._frozen = True
+            shared.overlay = MappingProxyType({})
+        return shared
+
+    def compact(self):
+        """Fold all layers into one, so that lookups of missing pairs do
+        not need to visit each of them"""
+        entries = dict(self._iter_items())
+        actions_by_state = defaultdict(list)
+        for _, layer_actions in self._all_layers():
+            for state, actions in layer_actions.items():
+                actions_by_state[state].extend(actions)
+        self._set_layers(((entries, actions_by_state),))
+        self._actions_by_state = defaultdict(list)
+        if self._frozen:
+            self.overlay = MappingProxyType({})
+        else:
+            self.overlay = {}
+
+    def _freeze_overlay(self):
+        if self.overlay:
+            self._set_layers(
+                self._layers + ((self.overlay, self._actions_by_state),))
+            self.overlay = {}
+            self._actions_by_state = defaultdict(list)
+            if len(self._layers) > self.max_layers:
+                self.compact()
+
+    def _set_layers(self, layers):
+        self._layers = tuple(layers)
+        self._lookup_layers = self._layers[::-1]
+
+    def _all_layers(self):
+        return self._layers + ((self.overlay, self._actions_by_state),)
+
+    def _in_layers(self, s_a):
+        for layer_entries, _ in self._lookup_layers:
+            if s_a in layer_entries:
+                return True
+        return False
+
+    def _iter_items(self):
+        seen = set()
+        for entries, _ in reversed(self._all_layers()):
+            for s_a, n_q in entries.items():
+                if s_a not in seen:
+                    seen.add(s_a)
+                    yield s_a, n_q
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['overlay'] = dict(self.overlay)
+        del state['_lookup_layers']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._frozen:
+            self.overlay = MappingProxyType(self.overlay)
+        self._lookup_layers = self._layers[::-1]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
 class QEstimatorBase:
     """Base class for estimators that can predict Q values based on
     state and action, and learn from experience based on
@@ -16,6 +196,16 @@ class QEstimatorBase:
     def learnFrom(S, A, target):
         raise NotImplementedError()
 
+    def predict_many(self, S, actions):
+        """Predict Q for each of the actions in state S, as a vector"""
+        return np.array([self.predict(S, A) for A in actions])
+
+    def learn_batch(self, pairs, targets):
+        """Learn from a sequence of (S, A) pairs and matching targets, with
+        the same result as calling learnFrom for each of them in turn"""
+        for (S, A), target in zip(pairs, targets):
+            self.learnFrom(S, A, target)
+
 
 class TabularQEstimator(QEstimatorBase):
     """An Estimator that simply keeps track of number of occurrences
@@ -23,40 +213,117 @@ class TabularQEstimator(QEstimatorBase):
     values"""
     def __init__(self, other=None):
         if other:
-            self._q_estimates = copy.deepcopy(other._q_estimates)
+            self._q_estimates = other._q_estimates.copy()
         else:
-            self._q_estimates = defaultdict(default_for_s_a)
+            self._q_estimates = QTable()
 
     def predict(self, S, A):
-        return self._q_estimates[(S, A)][1]
+        q_estimates = self._q_estimates
+        s_a = (S, A)
+        return (q_estimates.overlay.get(s_a) or q_estimates[s_a])[1]
+
+    def predict_many(self, S, actions):
+        q_estimates = self._q_estimates
+        overlay = q_estimates.overlay
+        return np.array([(overlay.get((S, A)) or q_estimates[(S, A)])[1]
+                         for A in actions])
 
     def learnFrom(self, S, A, target):
-        old_n, old_q = self._q_estimates[(S, A)]
+        q_estimates = self._q_estimates
+        s_a = (S, A)
+        old_n, old_q = q_estimates.overlay.get(s_a) or q_estimates[s_a]
         new_n = old_n + 1
         updated = (new_n, (old_n * old_q + target) / new_n)
-        self._q_estimates[(S, A)] = updated
+        q_estimates.overlay[s_a] = updated
+
+    def learn_batch(self, pairs, targets):
+        """Equivalent to calling learnFrom for each pair in turn, but
+        duplicate pairs are first summed up, so that each distinct pair
+        is updated only once"""
+        for s_a, (count, target_sum) in _target_totals(pairs, targets):
+            self._merge_entry(s_a, count, target_sum / count)
+
+    def merge(self, other):
+        """Fold the estimates of another tabular estimator, or of
+        TargetRuns, into this one, weighting the averages of both by their
+        occurrence counts"""
+        for s_a, (n, q) in _estimator_items(other):
+            if n:
+                self._merge_entry(s_a, n, q)
+
+    def _merge_entry(self, s_a, n, q):
+        old_n, old_q = self._q_estimates[s_a]
+        new_n = old_n + n
+        self._q_estimates[s_a] = (new_n, (old_n * old_q + n * q) / new_n)
+
+    def snapshot(self):
+        """A read-only copy of the estimator as it is now, made in O(1).
+        The estimator keeps learning without affecting the snapshot, and
+        only the entries it updates are copied."""
+        frozen = copy.copy(self)
+        frozen._q_estimates = self._q_estimates.snapshot()
+        return frozen
+
+    def __len__(self):
+        return len(self._q_estimates)
+
+    def state_visits(self, state):
+        """The total count over all actions taken in the state"""
+        q_estimates = self._q_estimates
+        return sum(q_estimates.get((state, action))[0]
+                   for action in q_estimates.actions(state))
+
+    def top_states(self, k):
+        """The k states with the most visits, most visited first"""
+        return heapq.nlargest(
+            k, self._q_estimates.states(), key=self.state_visits)
+
+    def top_actions(self, state, k=None):
+        """The ((state, action), (n, q)) entries for the k best actions in
+        the state, ordered by Q and then by count. All if k is None."""
+        q_estimates = self._q_estimates
+        items = [((state, action), q_estimates.get((state, action)))
+                 for action in q_estimates.actions(state)]
+
+        def rank(item):
+            n, q = item[1]
+            return (q, n)
+        if k is None:
+            return sorted(items, key=rank, reverse=True)
+        return heapq.nlargest(k, items, key=rank)
+
+    def write_report(self, file, max_states=None, max_actions=None):
+        """Write the estimates to a file one line at a time, grouped by
+        state in increasing order of visits. Optionally only the most
+        visited states, and only the best actions in each state."""
+        if max_states is None:
+            states = sorted(self._q_estimates.states(),
+                            key=self.state_visits)
+        else:
+            states = self.top_states(max_states)[::-1]
+        for state in states:
+            for s_a, n_q in self.top_actions(state, max_actions):
+                file.write('\n' + _format_rule(s_a, n_q))
+
+    def __setstate__(self, state):
+        if not isinstance(state['_q_estimates'], QTable):
+            state['_q_estimates'] = QTable(state['_q_estimates'])
+        self.__dict__.update(state)
 
     def __repr__(self):
         return repr(self._q_estimates)
 
     def __str__(self):
-        def format_rule(s_a, n_q):
-            state, (action_type, *action_params) = s_a
-            n, q = n_q
-            return 'State: {} - Action: {} {} : Q={}, N={}'.format(
-                state, action_type, action_params, q, n)
+        report = io.StringIO()
+        self.write_report(report)
+        return report.getvalue()
 
-        states = list(set([key[0] for key in self._q_estimates.keys()]))
-        states.sort(key=lambda state: sum([value[0] for key, value in self._q_estimates.items() if key[0] == state]))
 
-        all_lines = ''
-        for state in states:
-            items = [(key, value) for (key, value) in self._q_estimates.items() if key[0] == state]
-            items.sort(key=lambda item: (-item[1][1], -item[1][0]))
-            lines = [format_rule(s_a, n_q)
-                     for s_a, n_q in items]
-            all_lines = all_lines + '\n' + '\n'.join(lines)
-        return all_lines
+def _format_rule(s_a, n_q):
+    state, (action_type, *action_params) = s_a
+    n, q = n_q
+    return 'State: {} - Action: {} {} : Q={}, N={}'.format(
+        state, action_type, action_params, q, n)
 
 
 class CappedTabularQEstimator(TabularQEstimator):
@@ -64,19 +331,538 @@ class CappedTabularQEstimator(TabularQEstimator):
     of each state, action pair, and the average of the provided target
     values, but a maximum imposed on weight given to old observations"""
     def __init__(self, cap, other=None):
-        def default_for_s_a():
-            return (0, 0)
-
         self._cap = cap
         if other:
-            self._q_estimates = copy.deepcopy(other._q_estimates)
+            self._q_estimates = other._q_estimates.copy()
         else:
-            self._q_estimates = defaultdict(default_for_s_a)
+            self._q_estimates = QTable()
 
     def learnFrom(self, S, A, target):
-        old_n, old_q = self._q_estimates[(S, A)]
+        q_estimates = self._q_estimates
+        s_a = (S, A)
+        old_n, old_q = q_estimates.overlay.get(s_a) or q_estimates[s_a]
         if old_n > self._cap:
             old_n = self._cap
         new_n = old_n + 1
         updated = (new_n, (old_n * old_q + target) / new_n)
-        self._q_estimates[(S, A)] = updated
+        q_estimates.overlay[s_a] = updated
+
+    def learn_batch(self, pairs, targets):
+        """Equivalent to calling learnFrom for each pair in turn. The visits
+        to each distinct pair are collapsed into runs of equal targets, and
+        each run is applied in closed form: plain averaging while the count
+        is within the cap, and exponential forgetting beyond it."""
+        runs = TargetRuns()
+        runs.learn_batch(pairs, targets)
+        self._apply_runs(runs.runs())
+
+    def merge(self, other):
+        """Fold the targets recorded by TargetRuns into this estimator, with
+        the same result as learning from them in order. The targets behind
+        the averages of a tabular estimator are not known, so each of its
+        averages is learned as a run of that many equal targets."""
+        if isinstance(other, TargetRuns):
+            self._apply_runs(other.runs())
+        else:
+            self._apply_runs((s_a, [[q, n]])
+                             for s_a, (n, q) in _estimator_items(other)
+                             if n)
+
+    def _apply_runs(self, runs):
+        q_estimates = self._q_estimates
+        cap = self._cap
+        for s_a, pair_runs in runs:
+            n, q = q_estimates[s_a]
+            for target, count in pair_runs:
+                averaged = min(count, max(0, cap + 1 - n))
+                if averaged:
+                    q = (n * q + averaged * target) / (n + averaged)
+                    n += averaged
+                forgotten = count - averaged
+                if forgotten:
+                    q = target + (q - target) * (cap / (cap + 1)) ** forgotten
+                    n = cap + 1
+            q_estimates.overlay[s_a] = (n, q)
+
+
+class TargetRuns:
+    """Records the targets learned for each state action pair, in order,
+    as runs of equal consecutive targets. The partial estimators of
+    parallel evaluation are these, so that estimators whose updates depend
+    on the order of the targets, like CappedTabularQEstimator, can merge
+    them exactly."""
+    def __init__(self):
+        self._runs = {}
+
+    def learnFrom(self, S, A, target):
+        self._add((S, A), target)
+
+    def learn_batch(self, pairs, targets):
+        for s_a, target in zip(pairs, targets):
+            self._add(s_a, target)
+
+    def _add(self, s_a, target):
+        pair_runs = self._runs.get(s_a)
+        if pair_runs is None:
+            self._runs[s_a] = [[target, 1]]
+        elif pair_runs[-1][0] == target:
+            pair_runs[-1][1] += 1
+        else:
+            pair_runs.append([target, 1])
+
+    def runs(self):
+        """The ((state, action), [[target, count], ...]) runs of each pair"""
+        return self._runs.items()
+
+    def items(self):
+        """The ((state, action), (n, q)) averages of the targets of each
+        pair"""
+        for s_a, pair_runs in self._runs.items():
+            n = sum(count for _, count in pair_runs)
+            yield s_a, (n, sum(target * count
+                               for target, count in pair_runs) / n)
+
+    def __len__(self):
+        return len(self._runs)
+
+
+class ArrayTabularQEstimator(QEstimatorBase):
+    """Keeps the same statistics as TabularQEstimator, but interns states
+    and actions to dense integer ids and keeps the counts and averages in
+    growable NumPy arrays indexed by entry. Unlike TabularQEstimator,
+    predicting does not create entries for unseen state action pairs.
+
+    The entry of a pair is found through an array per state of the rows
+    of its actions, indexed by action id, with -1 for actions without an
+    entry. Actions are few and are given ids in the order they are first
+    seen, so these arrays stay short. With 10 actions per state, an entry
+    takes about 52 bytes besides its state, against about 209 bytes in
+    TabularQEstimator."""
+    def __init__(self, other=None, capacity=1024):
+        self._state_ids = {}
+        self._action_ids = {}
+        self._states = []
+        self._actions = []
+        self._state_rows = []
+        self._size = 0
+        self._entry_state = np.zeros(capacity, dtype=np.int32)
+        self._entry_action = np.zeros(capacity, dtype=np.int32)
+        self._n = np.zeros(capacity, dtype=np.int64)
+        self._q = np.zeros(capacity, dtype=np.float64)
+        if other:
+            self.merge(other)
+
+    @classmethod
+    def from_pickle(cls, path):
+        """Load a pickled dict of estimators, as saved by learn.py,
+        converting the tabular ones to array backed estimators"""
+        with open(path, 'rb') as file:
+            estimators = pickle.load(file)
+        return {name: cls(estimator) if estimator is not None else None
+                for name, estimator in estimators.items()}
+
+    def predict(self, S, A):
+        row = self._find_row(S, A)
+        if row is None:
+            return 0
+        return float(self._q[row])
+
+    def learnFrom(self, S, A, target):
+        row = self._row(S, A)
+        old_n = self._n[row]
+        new_n = old_n + 1
+        self._q[row] = (old_n * self._q[row] + target) / new_n
+        self._n[row] = new_n
+
+    def predict_many(self, S, actions):
+        values = np.zeros(len(actions))
+        state_id = self._state_ids.get(S)
+        if state_id is None:
+            return values
+        state_rows = self._state_rows[state_id]
+        action_ids = self._action_ids
+        for i, A in enumerate(actions):
+            action_id = action_ids.get(A, len(state_rows))
+            if action_id < len(state_rows) and state_rows[action_id] >= 0:
+                values[i] = self._q[state_rows[action_id]]
+        return values
+
+    def predict_batch(self, pairs):
+        """Predict Q for a sequence of (S, A) pairs at once"""
+        rows = [self._find_row(S, A) for S, A in pairs]
+        return np.array([0.0 if row is None else self._q[row]
+                         for row in rows])
+
+    def learn_batch(self, pairs, targets):
+        """Learn from a sequence of (S, A) pairs and matching targets.
+        Equivalent to calling learnFrom for each pair in turn, but updates
+        each distinct entry only once."""
+        rows = np.fromiter((self._row(S, A) for S, A in pairs),
+                           dtype=np.int64, count=len(pairs))
+        self._add_to_rows(rows, np.ones(len(rows), dtype=np.int64),
+                          np.asarray(targets, dtype=np.float64))
+
+    def merge(self, other):
+        """Fold the estimates of another tabular estimator into this one,
+        weighting the averages of both by their occurrence counts"""
+        items = [(s_a, n_q) for s_a, n_q in _estimator_items(other)
+                 if n_q[0]]
+        if not items:
+            return
+        rows = np.array([self._row(S, A) for (S, A), _ in items],
+                        dtype=np.int64)
+        counts = np.array([n for _, (n, _) in items], dtype=np.int64)
+        sums = np.array([n * q for _, (n, q) in items], dtype=np.float64)
+        self._add_to_rows(rows, counts, sums)
+
+    def items(self):
+        for row in range(self._size):
+            yield ((self._states[self._entry_state[row]],
+                    self._actions[self._entry_action[row]]),
+                   (int(self._n[row]), float(self._q[row])))
+
+    def __len__(self):
+        return self._size
+
+    def _add_to_rows(self, rows, counts, sums):
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        added_n = np.bincount(inverse, weights=counts)
+        added_sum = np.bincount(inverse, weights=sums)
+        old_n = self._n[unique_rows]
+        new_n = old_n + added_n.astype(np.int64)
+        self._q[unique_rows] = (
+            (old_n * self._q[unique_rows] + added_sum) / new_n)
+        self._n[unique_rows] = new_n
+
+    def _find_row(self, S, A):
+        state_id = self._state_ids.get(S)
+        if state_id is None:
+            return None
+        action_id = self._action_ids.get(A)
+        if action_id is None:
+            return None
+        state_rows = self._state_rows[state_id]
+        if action_id >= len(state_rows) or state_rows[action_id] < 0:
+            return None
+        return state_rows[action_id]
+
+    def _row(self, S, A):
+        state_id = self._state_ids.get(S)
+        if state_id is None:
+            state_id = self._state_ids[S] = len(self._states)
+            self._states.append(S)
+            self._state_rows.append(array('i'))
+        action_id = self._action_ids.get(A)
+        if action_id is None:
+            action_id = self._action_ids[A] = len(self._actions)
+            self._actions.append(A)
+        state_rows = self._state_rows[state_id]
+        if action_id >= len(state_rows):
+            state_rows.extend([-1] * (action_id + 1 - len(state_rows)))
+        row = state_rows[action_id]
+        if row < 0:
+            row = state_rows[action_id] = self._size
+            if row == len(self._n):
+                self._grow()
+            self._entry_state[row] = state_id
+            self._entry_action[row] = action_id
+            self._size += 1
+        return row
+
+    def _grow(self):
+        capacity = 2 * len(self._n)
+        for name in ('_entry_state', '_entry_action', '_n', '_q'):
+            old = getattr(self, name)
+            grown = np.zeros(capacity, dtype=old.dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+
+class BoundedTabularQEstimator(QEstimatorBase):
+    """Keeps the same statistics as TabularQEstimator for at most
+    max_entries state action pairs, and does not create entries when
+    predicting. Each entry takes roughly 200 bytes besides its state.
+
+    Once the table is full, the pairs that are not in it are counted in a
+    count-min sketch whose counters are halved periodically, and a pair is
+    only admitted once it has been seen min_frequency times recently, so
+    that pairs seen once do not displace anything. The entry evicted to
+    make room is the least recently updated ('lru') or the least visited
+    ('lfu') of sample_size entries sampled at random. With 'lfu' the new
+    pair must also have been seen more often than the victim. The samples
+    are drawn from rng, by default a random.Random seeded with 0."""
+    def __init__(self,
+                 max_entries=100000,
+                 eviction='lru',
+                 sample_size=8,
+                 min_frequency=2,
+                 sketch_depth=4,
+                 other=None,
+                 rng=None):
+        if eviction not in ('lru', 'lfu'):
+            raise ValueError('Unknown eviction rule: {}'.format(eviction))
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self._max_entries = max_entries
+        self._eviction = eviction
+        self._sample_size = sample_size
+        self._min_frequency = min_frequency
+        self._entries = {}
+        self._keys = []
+        self._clock = 0
+        self._rng = random.Random(0) if rng is None else rng
+        width = 1
+        while width < max_entries:
+            width *= 2
+        self._sketch = np.zeros((sketch_depth, width), dtype=np.int32)
+        self._sketch_additions = 0
+        self._sketch_reset_at = 10 * width
+        self.inserts = 0
+        self.evictions = 0
+        self.rejections = 0
+        if other:
+            self.merge(other)
+
+    def predict(self, S, A):
+        entry = self._entries.get((S, A))
+        if entry is None:
+            return 0
+        return entry[1]
+
+    def predict_many(self, S, actions):
+        entries = self._entries
+        values = np.zeros(len(actions))
+        for i, A in enumerate(actions):
+            entry = entries.get((S, A))
+            if entry is not None:
+                values[i] = entry[1]
+        return values
+
+    def learnFrom(self, S, A, target):
+        self._merge_entry((S, A), 1, target)
+
+    def learn_batch(self, pairs, targets):
+        """Equivalent to calling learnFrom for each pair in turn, but
+        duplicate pairs are first summed up, so that each distinct pair
+        is updated, or considered for admission, only once"""
+        for s_a, (count, target_sum) in _target_totals(pairs, targets):
+            self._merge_entry(s_a, count, target_sum / count)
+
+    def merge(self, other):
+        """Fold the estimates of another estimator into this one, weighting
+        the averages of both by their occurrence counts"""
+        for s_a, (n, q) in _estimator_items(other):
+            if n:
+                self._merge_entry(s_a, n, q)
+
+    def _merge_entry(self, s_a, n, q):
+        self._clock += 1
+        entry = self._entries.get(s_a)
+        if entry is not None:
+            old_n = entry[0]
+            entry[0] = old_n + n
+            entry[1] = (old_n * entry[1] + n * q) / entry[0]
+            entry[2] = self._clock
+        elif len(self._keys) < self._max_entries or self._admit(s_a, n):
+            self._entries[s_a] = [n, q, self._clock, len(self._keys)]
+            self._keys.append(s_a)
+            self.inserts += 1
+        else:
+            self.rejections += 1
+
+    def _admit(self, s_a, n):
+        """Count the pair in the sketch, and evict an entry to make room
+        for it if it is to be admitted"""
+        frequency = self._count(s_a, n)
+        if frequency < self._min_frequency:
+            return False
+        victim = self._victim()
+        if self._eviction == 'lfu' and frequency <= self._entries[victim][0]:
+            return False
+        self._evict(victim)
+        return True
+
+    def _victim(self):
+        keys = self._keys
+        entries = self._entries
+        rank = 2 if self._eviction == 'lru' else 0
+        sample = [keys[self._rng.randrange(len(keys))]
+                  for _ in range(self._sample_size)]
+        return min(sample, key=lambda s_a: entries[s_a][rank])
+
+    def _evict(self, s_a):
+        position = self._entries.pop(s_a)[3]
+        last = self._keys.pop()
+        if last != s_a:
+            self._keys[position] = last
+            self._entries[last][3] = position
+        self.evictions += 1
+
+    def _sketch_columns(self, s_a):
+        data = repr(s_a).encode('utf-8')
+        first = zlib.crc32(data)
+        second = zlib.crc32(data, 0x9e3779b9) | 1
+        width = self._sketch.shape[1]
+        return [(first + row * second) & (width - 1)
+                for row in range(self._sketch.shape[0])]
+
+    def _count(self, s_a, n):
+        columns = self._sketch_columns(s_a)
+        rows = range(len(columns))
+        self._sketch[rows, columns] += n
+        self._sketch_additions += n
+        frequency = int(self._sketch[rows, columns].min())
+        if self._sketch_additions >= self._sketch_reset_at:
+            self._sketch >>= 1
+            self._sketch_additions //= 2
+        return frequency
+
+    def items(self):
+        for s_a, (n, q, _, _) in self._entries.items():
+            yield s_a, (n, q)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def stats(self):
+        """Occupancy of the table and counts of what happened to the pairs
+        that were learned from"""
+        return OrderedDict([
+            ('entries', len(self._keys)),
+            ('max_entries', self._max_entries),
+            ('occupancy', len(self._keys) / self._max_entries),
+            ('inserts', self.inserts),
+            ('evictions', self.evictions),
+            ('rejections', self.rejections),
+        ])
+
+
+class LinearQEstimator(QEstimatorBase):
+    """Estimates Q as a linear function of hashed features, so memory is
+    fixed and similar states share what is learned about them.
+
+    The features of a state action pair are the whitespace separated
+    tokens of the state, and the state as a whole, each combined with the
+    action, plus the action alone. They are hashed with crc32 into
+    features slots, with a sign taken from the hash, and scaled to unit
+    norm. Weights are trained by stochastic gradient descent on the squared
+    error, in mini batches of batch_size pairs."""
+    def __init__(self,
+                 features=2 ** 18,
+                 learning_rate=0.02,
+                 batch_size=32,
+                 cache_size=65536):
+        self._features = features
+        self._learning_rate = learning_rate
+        self._batch_size = batch_size
+        self._cache_size = cache_size
+        self._weights = np.zeros(features)
+        self._cache = {}
+
+    def _encode(self, S, A):
+        s_a = (S, A)
+        encoded = self._cache.get(s_a)
+        if encoded is not None:
+            return encoded
+        action = repr(A).encode('utf-8')
+        if isinstance(S, str):
+            tokens = S.split() + [S]
+        else:
+            tokens = [repr(S)]
+        hashes = [zlib.crc32(action)] + [
+            zlib.crc32(action, zlib.crc32(token.encode('utf-8')))
+            for token in tokens]
+        hashes = np.array(hashes, dtype=np.int64)
+        indices = hashes % self._features
+        values = np.where(hashes & 0x80000000, -1.0, 1.0) / np.sqrt(
+            len(hashes))
+        encoded = (indices, values)
+        if len(self._cache) >= self._cache_size:
+            del self._cache[next(iter(self._cache))]
+        self._cache[s_a] = encoded
+        return encoded
+
+    def predict(self, S, A):
+        indices, values = self._encode(S, A)
+        return float(self._weights[indices] @ values)
+
+    def predict_many(self, S, actions):
+        weights = self._weights
+        return np.array([weights[indices] @ values
+                         for indices, values
+                         in (self._encode(S, A) for A in actions)])
+
+    def learnFrom(self, S, A, target):
+        indices, values = self._encode(S, A)
+        error = target - self._weights[indices] @ values
+        np.add.at(self._weights, indices,
+                  self._learning_rate * error * values)
+
+    def learn_batch(self, pairs, targets):
+        """Take a gradient step per mini batch of the pairs, with the
+        errors of a mini batch computed before its step"""
+        for start in range(0, len(pairs), self._batch_size):
+            end = start + self._batch_size
+            encoded = [self._encode(S, A) for S, A in pairs[start:end]]
+            lengths = [len(indices) for indices, _ in encoded]
+            indices = np.concatenate([indices for indices, _ in encoded])
+            values = np.concatenate([values for _, values in encoded])
+            predictions = np.add.reduceat(
+                self._weights[indices] * values,
+                np.cumsum([0] + lengths[:-1]))
+            errors = np.asarray(targets[start:end]) - predictions
+            np.add.at(self._weights, indices,
+                      self._learning_rate * np.repeat(errors, lengths)
+                      * values)
+
+    def merge(self, other):
+        """Learn the estimates of a tabular estimator, e.g. the partial
+        estimators of parallel evaluation, by taking a step towards the
+        average target of each pair seen. Steps are not weighted by the
+        occurrence counts, as steps many times the learning rate would
+        overshoot. Linear estimators have no table, so they can neither
+        be merged into others nor saved with model_format.save."""
+        pairs, targets = [], []
+        for s_a, (n, q) in _estimator_items(other):
+            if n:
+                pairs.append(s_a)
+                targets.append(q)
+        self.learn_batch(pairs, targets)
+
+    def snapshot(self):
+        """A copy of the estimator as it is now"""
+        frozen = copy.copy(self)
+        frozen._weights = self._weights.copy()
+        frozen._cache = {}
+        return frozen
+
+    def __len__(self):
+        return self._features
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+
+def _target_totals(pairs, targets):
+    """The (count, sum of targets) of each distinct pair, in the order the
+    pairs are first seen"""
+    totals = {}
+    for s_a, target in zip(pairs, targets):
+        total = totals.get(s_a)
+        if total is None:
+            totals[s_a] = [1, target]
+        else:
+            total[0] += 1
+            total[1] += target
+    return totals.items()
+
+
+def _estimator_items(estimator):
+    if isinstance(estimator, TabularQEstimator):
+        return estimator._q_estimates.items()
+    if not hasattr(estimator, 'items'):
+        raise TypeError('{} has no table of (n, q) entries'.format(
+            type(estimator).__name__))
+    return estimator.items()
@@ -0,0 +1,154 @@
+"""Sequential tests for deciding whether a win rate is above a threshold
+with as few games as possible. A test is fed the summary of each stats
+window as games are played, and reports when the decision is settled, so
+it can be passed as the stop callback of learn.mc_evaluate. The decision
+is the one learn.improve_via_self_play made by playing whole blocks of
+games, reached with fewer games where the win rate is far from the
+threshold."""
+from math import ceil, log, sqrt
+from statistics import NormalDist
+
+
+def wilson_interval(wins, games, z=1.96):
+    """The Wilson score interval for a binomial proportion"""
+    if not games:
+        return 0.0, 1.0
+    p = wins / games
+    denominator = 1 + z * z / games
+    centre = (p + z * z / (2 * games)) / denominator
+    half_width = (z * sqrt(p * (1 - p) / games + z * z / (4 * games * games))
+                  / denominator)
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+class SequentialWinRateTest:
+    """Decides whether the win rate is above threshold, as a block of up to
+    max_games games would by the win rate of its latest stats window.
+
+    The test is run on the counts of all games played so far. With method
+    'sprt' a sequential probability ratio test of win rate threshold -
+    indifference against threshold + indifference is run, with both error
+    rates 1 - confidence. With method 'wilson' the decision is settled
+    once the Wilson interval excludes the threshold, with the error rate
+    split evenly between the windows that fit in max_games, so that
+    looking after every window does not inflate it. Either way at least
+    min_games games are played, and a settled decision only stops the
+    block early if the latest window is on the same side of the threshold,
+    so that it is the decision the full block would make were it to end
+    there. An unsettled test decides by the latest window."""
+    def __init__(self,
+                 threshold,
+                 confidence=0.95,
+                 method='wilson',
+                 indifference=0.05,
+                 min_games=200,
+                 max_games=5000):
+        if method not in ('wilson', 'sprt'):
+            raise ValueError('Unknown sequential test: {}'.format(method))
+        self.threshold = threshold
+        self._method = method
+        self._min_games = min_games
+        self._max_games = max_games
+        self._error = 1 - confidence
+        self._z = None
+        self._p0 = threshold - indifference
+        self._p1 = threshold + indifference
+        self._upper_bound = log((1 - self._error) / self._error)
+        self._lower_bound = log(self._error / (1 - self._error))
+        self.games = 0
+        self.wins = 0
+        self.latest_win_rate = None
+        self.decision = None
+
+    @property
+    def games_played(self):
+        return self.games
+
+    def add(self, summary):
+        """Count the games of a stats window, and return True if the
+        decision is now settled"""
+        games = summary['games']
+        if self._z is None:
+            looks = max(1, ceil(self._max_games / games))
+            self._z = NormalDist().inv_cdf(1 - self._error / (2 * looks))
+        self.games += games
+        self.wins += round(summary['win_rate'] * games)
+        self.latest_win_rate = summary['win_rate']
+        self.decision = None
+        if self.games >= self._min_games:
+            if self._method == 'wilson':
+                decision = self._wilson_decision()
+            else:
+                decision = self._sprt_decision()
+            if decision is not None and decision == (
+                    self.latest_win_rate > self.threshold):
+                self.decision = decision
+        return self.decision is not None
+
+    def _wilson_decision(self):
+        low, high = self.interval()
+        if low > self.threshold:
+            return True
+        if high < self.threshold:
+            return False
+        return None
+
+    def _sprt_decision(self):
+        losses = self.games - self.wins
+        llr = (self.wins * log(self._p1 / self._p0)
+               + losses * log((1 - self._p1) / (1 - self._p0)))
+        if llr >= self._upper_bound:
+            return True
+        if llr <= self._lower_bound:
+            return False
+        return None
+
+    @property
+    def win_rate(self):
+        return self.wins / self.games if self.games else 0.0
+
+    def interval(self):
+        return wilson_interval(self.wins, self.games,
+                               self._z if self._z is not None else 1.96)
+
+    def above_threshold(self):
+        if self.decision is not None:
+            return self.decision
+        return (self.latest_win_rate is not None
+                and self.latest_win_rate > self.threshold)
+
+    def report(self):
+        low, high = self.interval()
+        print('win rate {:.3f} ({:.3f} to {:.3f}) over {} games, {:.3f} in '
+              'the latest window'.format(self.win_rate, low, high,
+                                         self.games, self.latest_win_rate))
+        if self.decision is None:
+            print('not settled after {} games'.format(self.games))
+        else:
+            print('{} {:.2f}, settled after {} games'.format(
+                'above' if self.decision else 'below',
+                self.threshold,
+                self.games))
+
+
+if __name__ == '__main__':
+    import random
+    random.seed(0)
+    window = 1000
+    for method in ('wilson', 'sprt'):
+        for p in (0.5, 0.6, 0.64, 0.66, 0.7, 0.8):
+            used = []
+            agreement = 0
+            for _ in range(200):
+                test = SequentialWinRateTest(0.65, method=method,
+                                             min_games=window)
+                rates = [sum(random.random() < p for _ in range(window))
+                         / window for _ in range(5)]
+                for rate in rates:
+                    if test.add({'games': window, 'win_rate': rate}):
+                        break
+                used.append(test.games)
+                agreement += test.above_threshold() == (rates[-1] > 0.65)
+            print('{:6s} p={:.2f} mean games {:7.1f} agreement with the '
+                  'full block {:.3f}'.format(method, p, sum(used) / len(used),
+                                             agreement / len(used)))
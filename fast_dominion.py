@@ -0,0 +1,495 @@
+"""An engine for the same simplified Dominion as dominion.py that keeps
+every pile as a vector of card counts indexed by card id instead of lists
+of cards. Drawing from a shuffled deck is equivalent to sampling the deck
+counts without replacement, so decks are never shuffled or ordered.
+
+The GameState here is a drop-in replacement for dominion.GameState, and
+test_fast_dominion.py checks it against it.
+
+It is not faster than the reference engine. Counts make scoring, playing
+and buying O(1), but a transition still publishes an Observation per card
+drawn and builds a Choice, as the protocol of game.Game requires, and that
+is most of its cost in either engine, now that both look cards up in the
+same card tables. Measured with benchmark.py, a transition takes 16-17us
+in either engine, and games played through game.Game run at 50-55 random
+games per second with either, with runs differing by more than the
+engines do. For more games per second, use the batch simulator in
+batch_dominion.py, which plays about 550 random games per second.
+
+The engine is kept for what counts make cheap and lists do not. clone()
+copies a state in about 12us, and redeals the hidden hands of a
+determinized copy in about 21us, which RolloutPlayer does for every
+rollout. batch_dominion.py and replay.py use its card id tables. As a
+second implementation of the rules it is a maintenance cost, and
+test_fast_dominion.py is what keeps it in step with dominion.py: it
+compares every transition of seeded games with the reference engine.
+
+    python fast_dominion.py [games]
+
+times transitions of random games in both engines."""
+import random
+import sys
+
+from choice import Choice
+from observation import Observation, EventType
+from dominion import (cards, card_by_name, card_ids, initial_player_cards,
+                      card_tables, supply_index, base_supply,
+                      kingdom_pile_size, ChoiceType, DominionStats,
+                      render_observation, treasure_modes)
+
+card_count = len(cards)
+
+card_names = card_tables.names
+
+card_coins = card_tables.coins
+
+card_effects = card_tables.effects
+
+card_is_action = card_tables.is_action
+
+card_vp = card_tables.vp
+
+card_costs = card_tables.costs
+
+treasure_ids = card_tables.treasure_ids
+
+play_actions = card_tables.play_actions
+
+buy_actions = card_tables.buy_actions
+
+END_TURN = (ChoiceType.end_turn,)
+
+PLAY_TREASURES = (ChoiceType.play_treasures,)
+
+
+def counts_of(card_list):
+    counts = [0] * card_count
+    for card in card_list:
+        counts[card_ids[card.name]] += 1
+    return counts
+
+
+initial_player_counts = counts_of(initial_player_cards)
+
+
+class PlayerState:
+    def __init__(self, name, observation_buffer, rng=random):
+        self._name = name
+        self._observations = observation_buffer
+        self._rng = rng
+        self._deck = list(initial_player_counts)
+        self._deck_size = sum(self._deck)
+        self._hand = [0] * card_count
+        self._played = [0] * card_count
+        self._discard = [0] * card_count
+        self._discard_size = 0
+        self._draw_hand()
+
+    def get_name(self):
+        return self._name
+
+    def get_available_spend(self):
+        return self._to_spend
+
+    def get_hand(self):
+        return [card_by_name[card_names[card_id]]
+                for card_id, count in enumerate(self._hand)
+                for _ in range(count)]
+
+    def get_hand_counts(self):
+        return self._hand
+
+    def get_buys(self):
+        return self._buys
+
+    def get_actions(self):
+        return self._actions
+
+    def draw(self):
+        if not self._deck_size:
+            self._deck, self._discard = self._discard, self._deck
+            self._deck_size, self._discard_size = self._discard_size, 0
+        if self._deck_size:
+            position = int(self._rng.random() * self._deck_size)
+            deck = self._deck
+            card_id = 0
+            while position >= deck[card_id]:
+                position -= deck[card_id]
+                card_id += 1
+            deck[card_id] -= 1
+            self._deck_size -= 1
+            self._hand[card_id] += 1
+            self._draw_card_observed(card_id)
+
+    def cleanup(self):
+        self._discard_hand()
+        self._discard_played()
+        self._draw_hand()
+
+    def start_turn(self, turn_number):
+        self._to_spend = 0
+        self._buys = 1
+        self._actions = 1
+        self._start_turn_observed(turn_number)
+
+    def buy(self, card_id):
+        assert self._to_spend >= card_costs[card_id], (
+            "Bought a card that cannot be afforded.")
+        assert self._buys >= 0, "Bought a card when no buys left"
+        self._to_spend -= card_costs[card_id]
+        self._buys -= 1
+        self._buy_card_observed(card_id)
+        self.gain(card_id)
+
+    def play(self, card_name):
+        card_id = card_ids[card_name]
+        assert self._hand[card_id], "Played a card that is not in hand"
+        if card_is_action[card_id]:
+            assert self._actions, "Played an action when no actions left"
+            self._actions -= 1
+        self._hand[card_id] -= 1
+        self._played[card_id] += 1
+        effects = card_effects[card_id]
+        self._to_spend += effects.coins
+        self._actions += effects.actions
+        self._buys += effects.buys
+        self._play_card_observed(card_id)
+        for _ in range(effects.cards):
+            self.draw()
+
+    def gain(self, card_id):
+        self._discard[card_id] += 1
+        self._discard_size += 1
+
+    def get_all_counts(self):
+        return [deck + hand + played + discard
+                for deck, hand, played, discard
+                in zip(self._deck, self._hand, self._played, self._discard)]
+
+    def get_all_cards(self):
+        return [card_by_name[card_names[card_id]]
+                for card_id, count in enumerate(self.get_all_counts())
+                for _ in range(count)]
+
+    def get_points(self):
+        return sum(count * vp
+                   for count, vp in zip(self.get_all_counts(), card_vp))
+
+    def _clone(self, observation_buffer, rng):
+        player = PlayerState.__new__(PlayerState)
+        player._name = self._name
+        player._observations = observation_buffer
+        player._rng = rng
+        player._deck = list(self._deck)
+        player._deck_size = self._deck_size
+        player._hand = list(self._hand)
+        player._played = list(self._played)
+        player._discard = list(self._discard)
+        player._discard_size = self._discard_size
+        player._to_spend = getattr(self, '_to_spend', 0)
+        player._buys = getattr(self, '_buys', 1)
+        player._actions = getattr(self, '_actions', 1)
+        return player
+
+    def _redeal_hand(self):
+        """Shuffle the hand back into the deck and draw as many cards, so
+        that the hand is no longer known"""
+        hand_size = sum(self._hand)
+        deck = self._deck
+        for card_id, count in enumerate(self._hand):
+            deck[card_id] += count
+        self._deck_size += hand_size
+        self._hand = [0] * card_count
+        observations = self._observations
+        self._observations = []
+        for _ in range(hand_size):
+            self.draw()
+        self._observations = observations
+
+    def _draw_hand(self):
+        for _ in range(5):
+            self.draw()
+
+    def _discard_hand(self):
+        self._move_all_to_discard(self._hand)
+        self._hand = [0] * card_count
+
+    def _discard_played(self):
+        self._move_all_to_discard(self._played)
+        self._played = [0] * card_count
+
+    def _move_all_to_discard(self, counts):
+        discard = self._discard
+        for card_id, count in enumerate(counts):
+            if count:
+                discard[card_id] += count
+                self._discard_size += count
+
+    def _observation(self, observation):
+        self._observations.append(observation)
+
+    def _start_turn_observed(self, turn_number):
+        self._observation(Observation(
+            EventType.start_turn, self._name, None, None, turn_number))
+
+    def _play_card_observed(self, card_id):
+        self._observation(Observation(
+            EventType.play, self._name, card_id, self._to_spend, None))
+
+    def _buy_card_observed(self, card_id):
+        self._observation(Observation(
+            EventType.buy, self._name, card_id, None, None))
+
+    def _draw_card_observed(self, card_id):
+        self._observation(Observation(
+            EventType.draw, self._name, card_id, None, None))
+
+
+def supply_counts(kingdom=()):
+    """The initial supply of a game with the given kingdom cards. Cards
+    that are not in the game have a count of -1, so that only their piles
+    count as empty when they run out."""
+    supply = [-1] * card_count
+    for name, count in base_supply:
+        supply[card_ids[name]] = count
+    for name in kingdom:
+        supply[card_ids[name]] = kingdom_pile_size
+    return supply
+
+
+initial_supply = supply_counts()
+
+province_id = card_ids['province']
+
+
+class GameState:
+    """Takes the same treasures, skip_forced and kingdom options as
+    dominion.GameState"""
+    def __init__(self, players, rng=random, treasures='manual',
+                 skip_forced=False, kingdom=()):
+        if treasures not in treasure_modes:
+            raise ValueError('Unknown treasure mode: {}'.format(treasures))
+        self._treasures = treasures
+        self._skip_forced = skip_forced
+        self._rng = rng
+        self._observations = []
+        self._published_observations = 0
+        self._turn = 1
+        self._players = [PlayerState(player, self._observations, rng)
+                         for player in players]
+        self._supply = supply_counts(kingdom)
+        self._supply_index = supply_index(kingdom)
+        self._active_player_idx = 0
+
+    def get_first_choice(self):
+        self._players[0].start_turn(self._turn)
+        choice = self._next_decision()
+        return self._publish_observations(), choice
+
+    def get_next_choice(self, chosen):
+        self._apply(chosen)
+        choice = self._next_decision()
+        return self._publish_observations(), choice
+
+    def _apply(self, chosen):
+        choice_type = chosen[0]
+        if choice_type == ChoiceType.buy:
+            self._purchase(self._active_player(), chosen[1])
+            if self._active_player().get_buys() == 0:
+                self._cleanup_and_next_player()
+        elif choice_type == ChoiceType.play:
+            self._active_player().play(chosen[1])
+        elif choice_type == ChoiceType.play_treasures:
+            self._play_treasures(self._active_player())
+        else:
+            self._cleanup_and_next_player()
+
+    def _next_decision(self):
+        while True:
+            player = self._active_player()
+            if self._treasures == 'auto':
+                self._play_treasures(player)
+            choice = self._purchase_or_play_treasure_choice(player)
+            if (not self._skip_forced
+                    or len(choice.alternatives) > 1
+                    or self.is_game_over()):
+                return choice
+            self._apply(choice.alternatives[0])
+
+    def _play_treasures(self, player):
+        hand = player.get_hand_counts()
+        for card_id in treasure_ids:
+            for _ in range(hand[card_id]):
+                player.play(card_names[card_id])
+
+    def get_choice(self):
+        """The choice that is currently waiting to be made"""
+        return self._purchase_or_play_treasure_choice(self._active_player())
+
+    def clone(self, rng=None, determinize_for=None):
+        """A copy of the state that can be played forward independently,
+        e.g. for rollouts. The copy draws from its own random stream,
+        rng if given and otherwise one seeded from this state's stream,
+        and starts with no pending observations.
+
+        Decks are kept as counts, so their order is never known. If
+        determinize_for names a player, the hands of the other players
+        are redealt from their hands and decks, so that the copy only
+        reflects what that player can know."""
+        if rng is None:
+            rng = random.Random(self._rng.getrandbits(64))
+        state = GameState.__new__(GameState)
+        state._treasures = self._treasures
+        state._skip_forced = self._skip_forced
+        state._rng = rng
+        state._observations = []
+        state._published_observations = 0
+        state._turn = self._turn
+        state._players = [player._clone(state._observations, rng)
+                          for player in self._players]
+        state._supply = list(self._supply)
+        state._supply_index = self._supply_index
+        state._active_player_idx = self._active_player_idx
+        if determinize_for is not None:
+            for player in state._players:
+                if player._name != determinize_for:
+                    player._redeal_hand()
+        return state
+
+    def is_game_over(self):
+        supply = self._supply
+        return not supply[province_id] or supply.count(0) >= 3
+
+    def print_result(self):
+        if not self.is_game_over():
+            print("Error, game is not over")
+        else:
+            card_counts = {
+                player.get_name(): {
+                    card_names[card_id]: count
+                    for card_id, count in enumerate(player.get_all_counts())
+                    if count}
+                for player in self._players}
+            points = {player.get_name(): player.get_points()
+                      for player in self._players}
+            print("Points:", points)
+            print("Card counts:", card_counts)
+
+    def get_stats(self):
+        if not self.is_game_over():
+            return None
+        else:
+            winner, score = self.get_winner()
+            return DominionStats(
+                winner=winner,
+                turns=self._turn,
+                score=score
+            )
+
+    def get_scores(self):
+        """The points of each player by name"""
+        return {player.get_name(): player.get_points()
+                for player in self._players}
+
+    def get_winner(self):
+        if not self.is_game_over():
+            return None
+        else:
+            winner, most_points = None, -1000
+            for player in self._players:
+                points = player.get_points()
+                if (points > most_points):
+                    winner, most_points = player.get_name(), points
+            return winner, most_points
+
+    def _publish_observations(self):
+        new_observations = self._observations[self._published_observations:]
+        self._published_observations = len(self._observations)
+        return new_observations
+
+    def _active_player(self):
+        return self._players[self._active_player_idx]
+
+    def _purchase_or_play_treasure_choice(self, player):
+        hand = player.get_hand_counts()
+        index = self._supply_index
+        supply = self._supply
+        plays = [action for card_id, action in index.treasure_plays
+                 if hand[card_id]]
+        if plays and self._treasures == 'macro':
+            plays = [PLAY_TREASURES]
+        if player.get_actions():
+            plays += [action for card_id, action in index.action_plays
+                      if hand[card_id]]
+        return Choice(
+            player.get_name(),
+            plays
+            + [action
+               for card_id, action
+               in index.buys_at(player.get_available_spend())
+               if supply[card_id]]
+            + [END_TURN])
+
+    def _purchase(self, player, card_name):
+        card_id = card_ids[card_name]
+        assert self._supply[card_id], (
+            "Purchase from an empty supply deck should not be possible")
+        self._supply[card_id] -= 1
+        player.buy(card_id)
+
+    def _cleanup_and_next_player(self):
+        self._active_player().cleanup()
+        self._next_player()
+
+    def _next_player(self):
+        self._active_player_idx += 1
+        if self._active_player_idx >= len(self._players):
+            self._active_player_idx = 0
+            self._turn += 1
+        self._active_player().start_turn(self._turn)
+
+    @classmethod
+    def from_reference(cls, reference):
+        """Build a state equivalent to a dominion.GameState, e.g. to compare
+        transitions of the two engines"""
+        state = cls.__new__(cls)
+        state._treasures = getattr(reference, '_treasures', 'manual')
+        state._skip_forced = getattr(reference, '_skip_forced', False)
+        state._rng = random
+        state._observations = []
+        state._published_observations = 0
+        state._turn = reference._turn
+        state._players = []
+        for reference_player in reference._players:
+            player = PlayerState.__new__(PlayerState)
+            player._name = reference_player._name
+            player._observations = state._observations
+            player._rng = random
+            player._deck = counts_of(reference_player._deck)
+            player._deck_size = len(reference_player._deck)
+            player._hand = counts_of(reference_player._hand)
+            player._played = counts_of(reference_player._played)
+            player._discard = counts_of(reference_player._discard)
+            player._discard_size = len(reference_player._discard)
+            player._to_spend = getattr(reference_player, '_to_spend', 0)
+            player._buys = getattr(reference_player, '_buys', 1)
+            player._actions = getattr(reference_player, '_actions', 1)
+            state._players.append(player)
+        state._supply = [len(reference._supply[name])
+                         if name in reference._supply else -1
+                         for name in card_names]
+        state._supply_index = reference._supply_index
+        state._active_player_idx = reference._active_player_idx
+        return state
+
+
+if __name__ == '__main__':
+    from benchmark import bench_get_next_choice
+    import dominion
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    reference = bench_get_next_choice(dominion, games)
+    fast = bench_get_next_choice(sys.modules[__name__], games)
+    print('reference {:.2f}us, fast {:.2f}us per transition, {:.2f}x'.format(
+        reference['microseconds_per_call'],
+        fast['microseconds_per_call'],
+        reference['microseconds_per_call'] / fast['microseconds_per_call']))
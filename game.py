@@ -1,58 +1,169 @@
 import pickle
 import sys
+import time
 
 from player import HumanPlayer, RandomPlayer, AgentWithLatestObservationAsState
 from policy import Greedy
-from random import shuffle
+from model_format import MappedQEstimator
+import random
 import dominion
+from observation import Interest
 
 
 class Game:
     def __init__(self, players={
                                 'mikko': HumanPlayer(),
                                 'beta-ai': RandomPlayer()
-                                }):
+                                },
+                 engine=dominion,
+                 headless=False,
+                 instrumentation=None,
+                 rng=random,
+                 engine_options=None):
+        """Players that define observe_event receive the structured
+        observations. Others receive the rendered text through observation,
+        unless the game is headless, in which case no text is rendered.
+
+        Players receive the observations their interest attribute asks
+        for, an observation.Interest: none, only the latest one right
+        before each of their choices, all of them, or all of them as seen
+        by others. Players without one receive all of them.
+
+        Players that define attach are given the game state and their
+        name, e.g. to simulate the rest of the game from clones of it.
+
+        If an instrumentation.Instrumentation is given, the time spent in
+        each phase of play is accounted to it.
+
+        The seating and the game state draw from rng, which defaults to
+        the global random module. engine_options are passed on to the
+        engine's GameState, e.g. treasures='auto'."""
         self.players = players
+        self._instrumentation = instrumentation
         player_names = list(players.keys())
-        shuffle(player_names)
-        self.game_state = dominion.GameState(player_names)
+        rng.shuffle(player_names)
+        self.game_state = engine.GameState(player_names, rng,
+                                           **(engine_options or {}))
+        for player_name, player in players.items():
+            if hasattr(player, 'attach'):
+                player.attach(self.game_state, player_name)
+        self._render = engine.render_observation
+        self._event_observers = []
+        self._text_observers = []
+        self._latest_observers = {}
+        self._latest = None
+        self._published = 0
+        for player_name, player in players.items():
+            interest = getattr(player, 'interest', Interest.stream)
+            if interest == Interest.nothing:
+                continue
+            events = hasattr(player, 'observe_event')
+            if events:
+                observe = player.observe_event
+                observers = self._event_observers
+            elif not headless:
+                observe = player.observation
+                observers = self._text_observers
+            else:
+                continue
+            if interest == Interest.latest:
+                self._latest_observers[player_name] = [observe, events, 0]
+            else:
+                # public observers are given a name no observation has
+                observers.append(
+                    (player_name if interest == Interest.stream else None,
+                     observe))
 
     def play(self):
+        if self._instrumentation is not None:
+            return self._play_instrumented(self._instrumentation)
         observations, choice = self.game_state.get_first_choice()
         chosen = self._next_choice(observations, choice)
         while not self.game_state.is_game_over():
             observations, choice = self.game_state.get_next_choice(chosen)
             chosen = self._next_choice(observations, choice)
 
+    def _play_instrumented(self, instrumentation):
+        clock = time.perf_counter
+        decisions = 0
+        observations, choice = self.game_state.get_first_choice()
+        while True:
+            start = clock()
+            self._communicate_observations(observations, choice.player)
+            communicated = clock()
+            choice_idx = self.players[choice.player].choose(
+                choice.alternatives)
+            chosen = choice.alternatives[choice_idx]
+            chose = clock()
+            instrumentation.add('_communicate_observations',
+                                communicated - start)
+            instrumentation.add('player.choose', chose - communicated)
+            decisions += 1
+            if self.game_state.is_game_over():
+                break
+            start = clock()
+            observations, choice = self.game_state.get_next_choice(chosen)
+            instrumentation.add('get_next_choice', clock() - start)
+        instrumentation.record_game(decisions)
+
     def get_winner(self):
         return self.game_state.get_winner()
 
     def get_stats(self):
         return self.game_state.get_stats()
 
-    def _communicate_observations(self, observations):
+    def get_scores(self):
+        return self.game_state.get_scores()
+
+    def _communicate_observations(self, observations, chooser):
+        """Deliver the new observations to the players that take all of
+        them, and the latest observation to the player about to choose if
+        it only takes that"""
+        if observations:
+            self._latest = observations[-1]
+            self._published += len(observations)
+        latest_observer = self._latest_observers.get(chooser)
+        if latest_observer and latest_observer[2] < self._published:
+            observe, events, _ = latest_observer
+            latest_observer[2] = self._published
+            private = chooser == self._latest.actor
+            if events:
+                observe(self._latest, private)
+            else:
+                observe(self._render(self._latest, private))
+        if not (self._event_observers or self._text_observers):
+            return
         for observation in observations:
-            for player_name, player in self.players.items():
-                if player_name == observation.audience:
-                    player.observation(observation.private)
-                else:
-                    player.observation(observation.public)
+            for player_name, observe in self._event_observers:
+                observe(observation, player_name == observation.actor)
+            if self._text_observers:
+                public = None
+                for player_name, observe in self._text_observers:
+                    if player_name == observation.actor:
+                        observe(self._render(observation, True))
+                    else:
+                        if public is None:
+                            public = self._render(observation, False)
+                        observe(public)
 
     def _next_choice(self, observations, choice):
-        self._communicate_observations(observations)
+        self._communicate_observations(observations, choice.player)
         choice_idx = self.players[choice.player].choose(choice.alternatives)
         return choice.alternatives[choice_idx]
 
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
-        with open(sys.argv[1], 'rb') as file:
-            estimators = pickle.load(file)
+        if sys.argv[1].endswith('.qtab'):
+            estimator = MappedQEstimator(sys.argv[1])
+        else:
+            with open(sys.argv[1], 'rb') as file:
+                estimator = pickle.load(file)['old_estimator']
         game = Game(
             players={
                 'mikko': HumanPlayer(),
                 'beta-ai': AgentWithLatestObservationAsState(
-                    Greedy(estimators['old_estimator']),
+                    Greedy(estimator),
                     dominion.ignore_player_and_turn_projection)
             })
     else:
@@ -0,0 +1,90 @@
+from collections import OrderedDict, defaultdict
+import time
+
+
+class Instrumentation:
+    """Accumulates wall clock time and call counts per phase of play and
+    learning, the number of decisions per game, and samples of estimator
+    table sizes. Phases may nest, e.g. projection happens while observations
+    are being communicated.
+
+    Instrumentation is opt-in: code that accepts an instrumentation object
+    takes a separate path when given one, so it costs nothing when None."""
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.games = 0
+        self.decisions = 0
+        self.max_decisions = 0
+        self.table_sizes = []
+
+    def add(self, phase, seconds, calls=1):
+        self.times[phase] += seconds
+        self.calls[phase] += calls
+
+    def record_game(self, decisions):
+        self.games += 1
+        self.decisions += decisions
+        self.max_decisions = max(self.max_decisions, decisions)
+
+    def record_table_size(self, games, size):
+        self.table_sizes.append((games, size))
+
+    def merge(self, other):
+        for phase, seconds in other.times.items():
+            self.add(phase, seconds, other.calls[phase])
+        self.games += other.games
+        self.decisions += other.decisions
+        self.max_decisions = max(self.max_decisions, other.max_decisions)
+        self.table_sizes.extend(other.table_sizes)
+
+    def summarise(self):
+        summary = OrderedDict()
+        for phase in sorted(self.times, key=self.times.get, reverse=True):
+            calls = self.calls[phase]
+            summary[phase] = OrderedDict([
+                ('seconds', self.times[phase]),
+                ('calls', calls),
+                ('microseconds_per_call',
+                 1e6 * self.times[phase] / calls if calls else 0),
+            ])
+        summary['games'] = self.games
+        summary['decisions_per_game'] = (
+            self.decisions / self.games if self.games else 0)
+        summary['max_decisions_per_game'] = self.max_decisions
+        if self.table_sizes:
+            summary['table_size'] = self.table_sizes[-1][1]
+        return summary
+
+    def report(self):
+        for key, value in self.summarise().items():
+            if isinstance(value, dict):
+                print('{}: {:.3f}s in {} calls ({:.2f}us per call)'.format(
+                    key,
+                    value['seconds'],
+                    value['calls'],
+                    value['microseconds_per_call']))
+            else:
+                print('{} = {}'.format(key, value))
+
+
+class TimedProjection:
+    """Wraps a projection, accounting the time spent in it to the
+    'projection' phase, for both text and structured observations"""
+    def __init__(self, projection, instrumentation):
+        self._projection = projection
+        self._instrumentation = instrumentation
+        if hasattr(projection, 'project_event'):
+            self.project_event = self._project_event
+
+    def __call__(self, state):
+        start = time.perf_counter()
+        projected = self._projection(state)
+        self._instrumentation.add('projection', time.perf_counter() - start)
+        return projected
+
+    def _project_event(self, observation, private):
+        start = time.perf_counter()
+        projected = self._projection.project_event(observation, private)
+        self._instrumentation.add('projection', time.perf_counter() - start)
+        return projected
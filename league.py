@@ -0,0 +1,274 @@
+"""Leagues of many agents playing each other at tables of two or more
+players, with Elo ratings updated as results come in. Plain Elo, extended
+to bigger tables pairwise, stands in for TrueSkill style ratings here: it
+needs no dependencies, but it does not track how uncertain a rating is.
+
+Games are played in a pool of worker processes, and each result is
+appended to a JSONL file as soon as it arrives. A league started with an
+existing results file replays the results in it and only plays the games
+that are missing, so an interrupted league can be resumed.
+
+    python league.py results.jsonl random models/final-models-<ts>.p ...
+
+plays a round robin league between the given entrants: 'random' for a
+random player, pickled models as saved by learn.py, or .qtab models."""
+from collections import OrderedDict
+from itertools import combinations
+from multiprocessing import Pool
+import argparse
+import json
+import os
+import pickle
+
+import fast_dominion
+from dominion import ignore_player_and_turn_projection, render_observation
+from game import Game
+from model_format import MappedQEstimator
+from observation import Interest
+from player import RandomPlayer, AgentWithLatestObservationAsState
+from policy import Greedy
+from seeding import stream
+
+# learn.py trains agents under the name 'epsilon' against 'random', and
+# its projection drops both names, so every agent sees itself as SELF and
+# all other players as OTHER
+SELF = 'epsilon'
+OTHER = 'random'
+
+
+class _Seat:
+    """Seats an agent at a table, showing it the observations of the game
+    from its own perspective"""
+    def __init__(self, agent, name):
+        self._agent = agent
+        self._name = name
+        self._observe_event = getattr(agent, 'observe_event', None)
+        self.interest = getattr(agent, 'interest', Interest.stream)
+        if hasattr(agent, 'attach'):
+            self.attach = agent.attach
+
+    def observe_event(self, observation, private):
+        observation = observation._replace(
+            actor=SELF if observation.actor == self._name else OTHER)
+        if self._observe_event:
+            self._observe_event(observation, private)
+        else:
+            self._agent.observation(render_observation(observation, private))
+
+    def choose(self, actions):
+        return self._agent.choose(actions)
+
+    def reseed(self, rng):
+        if hasattr(self._agent, 'reseed'):
+            self._agent.reseed(rng)
+
+    def reset(self):
+        if hasattr(self._agent, 'reset'):
+            self._agent.reset()
+
+
+class EloRatings:
+    """Elo ratings, along with games played and won and average points.
+    A table of more than two players counts as a game between every pair
+    of them, scored by their points, with each pairwise update scaled down
+    by the number of opponents."""
+    def __init__(self, k=16, initial=1500):
+        self._k = k
+        self._initial = initial
+        self.ratings = {}
+        self.games = {}
+        self.wins = {}
+        self.points = {}
+
+    def rating(self, name):
+        return self.ratings.get(name, self._initial)
+
+    def update(self, scores):
+        """Update the ratings with the points of each entrant at a table"""
+        names = list(scores)
+        k = self._k / max(1, len(names) - 1)
+        changes = dict.fromkeys(names, 0.0)
+        for a, b in combinations(names, 2):
+            difference = self.rating(b) - self.rating(a)
+            expected = 1 / (1 + 10 ** (difference / 400))
+            if scores[a] > scores[b]:
+                actual = 1.0
+            elif scores[a] < scores[b]:
+                actual = 0.0
+            else:
+                actual = 0.5
+            changes[a] += k * (actual - expected)
+            changes[b] -= k * (actual - expected)
+        best = max(scores.values())
+        for name in names:
+            self.ratings[name] = self.rating(name) + changes[name]
+            self.games[name] = self.games.get(name, 0) + 1
+            self.wins[name] = self.wins.get(name, 0) + (scores[name] == best)
+            self.points[name] = self.points.get(name, 0) + scores[name]
+
+    def table(self):
+        """Rows of name, rating, games, win rate and average points, best
+        rated first"""
+        return [OrderedDict([
+                    ('name', name),
+                    ('rating', self.ratings[name]),
+                    ('games', self.games[name]),
+                    ('win_rate', self.wins[name] / self.games[name]),
+                    ('average_points', self.points[name] / self.games[name]),
+                ])
+                for name in sorted(self.ratings,
+                                   key=self.ratings.get,
+                                   reverse=True)]
+
+    def report(self):
+        for row in self.table():
+            print('{name:40s} {rating:7.1f} {games:6d} {win_rate:6.3f} '
+                  '{average_points:6.1f}'.format(**row))
+
+
+def round_robin(names, table_size=2, games_per_table=1):
+    """Every combination of table_size entrants, each played
+    games_per_table times"""
+    return [list(table)
+            for table in combinations(names, table_size)
+            for _ in range(games_per_table)]
+
+
+def swiss_round(names, ratings, table_size=2):
+    """Tables of entrants with similar ratings. Entrants left over when
+    the entrants do not divide into full tables sit the round out."""
+    ranked = sorted(names, key=ratings.rating, reverse=True)
+    return [ranked[start:start + table_size]
+            for start in range(0, len(ranked) - table_size + 1, table_size)]
+
+
+_worker_entrants = None
+
+
+def _init_worker(payload):
+    global _worker_entrants
+    _worker_entrants = pickle.loads(payload)
+
+
+def _play_table(task):
+    key, table, seed, engine_options = task
+    round_, index = key
+    players = OrderedDict()
+    for seat, name in enumerate(table):
+        player = _Seat(_worker_entrants[name], name)
+        player.reset()
+        player.reseed(stream(seed, round_, index, 1 + seat))
+        players[name] = player
+    game = Game(players,
+                engine=fast_dominion,
+                headless=True,
+                rng=stream(seed, round_, index, 0),
+                engine_options=engine_options)
+    game.play()
+    return key, table, game.get_scores(), game.get_stats().turns
+
+
+class League:
+    """Plays games between entrants, a dict from name to agent, and keeps
+    their ratings. Agents are sent to the workers once, so they must be
+    picklable, and they are reset and reseeded for every game, from the
+    seed and the key of the game."""
+    def __init__(self, entrants, results_path, seed=0, workers=None,
+                 engine_options=None, ratings=None):
+        self._entrants = entrants
+        self._results_path = results_path
+        self._seed = seed
+        self._workers = workers
+        self._engine_options = engine_options
+        self.ratings = ratings if ratings is not None else EloRatings()
+        self.results = []
+        self._played = set()
+        if os.path.exists(results_path):
+            with open(results_path) as file:
+                for line in file:
+                    if line.strip():
+                        self._record(json.loads(line))
+
+    def _record(self, result):
+        self.results.append(result)
+        self._played.add(tuple(result['key']))
+        self.ratings.update(result['scores'])
+
+    def play_round_robin(self, table_size=2, games_per_table=1):
+        tables = round_robin(list(self._entrants), table_size,
+                             games_per_table)
+        self._play(0, tables)
+
+    def play_swiss(self, rounds, table_size=2):
+        """Rounds of swiss pairings, numbered from 1. The tables of a round
+        are paired by the ratings after the rounds before it, also when
+        the round is resumed."""
+        for round_ in range(1, rounds + 1):
+            ratings = EloRatings(self.ratings._k, self.ratings._initial)
+            for result in self.results:
+                if 0 < result['key'][0] < round_:
+                    ratings.update(result['scores'])
+            self._play(round_, swiss_round(list(self._entrants), ratings,
+                                           table_size))
+
+    def _play(self, round_, tables):
+        tasks = [((round_, index), table, self._seed, self._engine_options)
+                 for index, table in enumerate(tables)
+                 if (round_, index) not in self._played]
+        if not tasks:
+            return
+        payload = pickle.dumps(self._entrants)
+        with Pool(self._workers, _init_worker, (payload,)) as pool, \
+                open(self._results_path, 'a') as file:
+            for key, table, scores, turns in pool.imap_unordered(
+                    _play_table, tasks):
+                result = OrderedDict([('key', list(key)),
+                                      ('table', table),
+                                      ('scores', scores),
+                                      ('turns', turns)])
+                file.write(json.dumps(result) + '\n')
+                file.flush()
+                self._record(result)
+
+
+def greedy_agent(estimator):
+    return AgentWithLatestObservationAsState(
+        Greedy(estimator), ignore_player_and_turn_projection)
+
+
+def load_entrants(specs):
+    """Entrants for 'random', .qtab model files, and pickles of estimators
+    saved by learn.py, which give one entrant per estimator in them"""
+    entrants = OrderedDict()
+    for spec in specs:
+        if spec == 'random':
+            entrants['random'] = RandomPlayer()
+        elif spec.endswith('.qtab'):
+            entrants[spec] = greedy_agent(MappedQEstimator(spec))
+        else:
+            with open(spec, 'rb') as file:
+                estimators = pickle.load(file)
+            for name, estimator in estimators.items():
+                if estimator is not None:
+                    entrants['{}:{}'.format(spec, name)] = greedy_agent(
+                        estimator)
+    return entrants
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('results')
+    parser.add_argument('entrants', nargs='+')
+    parser.add_argument('--table-size', type=int, default=2)
+    parser.add_argument('--games-per-table', type=int, default=10)
+    parser.add_argument('--swiss', type=int, metavar='ROUNDS')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    league = League(load_entrants(args.entrants), args.results,
+                    seed=args.seed, workers=args.workers)
+    if args.swiss:
+        league.play_swiss(args.swiss, args.table_size)
+    else:
+        league.play_round_robin(args.table_size, args.games_per_table)
+    league.ratings.report()
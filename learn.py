@@ -1,31 +1,44 @@
 from game import Game
 from player import RandomPlayer, AgentWithLatestObservationAsState
 from collections import namedtuple, OrderedDict
-import numpy as np
-from estimators import TabularQEstimator
+from estimators import TabularQEstimator, TargetRuns
 from policy import Greedy, EpsilonSoft
 from datetime import datetime
+import copy
 import pickle
+import sys
+import time
+from multiprocessing import Pool
+import model_format
+from instrumentation import Instrumentation, TimedProjection
 from dominion import ignore_player_and_turn_projection
-
-import matplotlib.pyplot as plt
+from telemetry import MetricsWriter, RunningStats, plot_metrics
+from evaluation import SequentialWinRateTest
+from seeding import game_streams
+from replay import EpisodeRecorder
 
 GameStats = namedtuple('GameStats', 'win turns score')
 
 
 class Stats:
     def __init__(self):
-        self._stats = []
+        self._wins = RunningStats()
+        self._turns = RunningStats()
+        self._scores = RunningStats()
 
     def add_game(self, stats):
-        self._stats.append(stats)
+        self._wins.add(float(stats.win))
+        self._turns.add(stats.turns)
+        self._scores.add(stats.score)
 
     def summarise(self):
         return OrderedDict([
-            ('games', len(self._stats)),
-            ('win_rate', np.mean([game.win for game in self._stats])),
-            ('average_turns', np.mean([game.turns for game in self._stats])),
-            ('average_score', np.mean([game.score for game in self._stats])),
+            ('games', self._wins.count),
+            ('win_rate', self._wins.mean),
+            ('average_turns', self._turns.mean),
+            ('average_score', self._scores.mean),
+            ('turns_std', self._turns.std()),
+            ('score_std', self._scores.std()),
         ])
 
 
@@ -36,105 +49,409 @@ def dominion_stats_to_game_stats(stats, player):
         score=stats.score)
 
 
+def play_episode(policy,
+                 opponent,
+                 instrumentation=None,
+                 streams=None,
+                 replay=None,
+                 engine_options=None,
+                 projection=None):
+    """Play one game of the policy against the opponent, and return
+    the subjective stats, the decisions made by the policy, and the
+    return of the episode. An opponent that keeps a record of its
+    episode, like AgentWithLatestObservationAsState, is reset first, so
+    that it does not grow over a run. If seeding.GameStreams are given,
+    the game, the policy and the opponent are reseeded to draw from them.
+    If a replay.ReplayWriter or EpisodeRecorder is given, the episode is
+    appended to it. engine_options are passed on to the engine, e.g. to
+    play treasures automatically. The policy sees the projection of the
+    latest observation, by default ignore_player_and_turn_projection."""
+    if projection is None:
+        projection = ignore_player_and_turn_projection
+    if instrumentation is not None:
+        projection = TimedProjection(projection, instrumentation)
+    agent = AgentWithLatestObservationAsState(
+        policy, projection, record_events=replay is not None)
+    if hasattr(opponent, 'reset'):
+        opponent.reset()
+    game_options = {'instrumentation': instrumentation,
+                    'engine_options': engine_options}
+    if streams is not None:
+        agent.reseed(streams.policy)
+        if hasattr(opponent, 'reseed'):
+            opponent.reseed(streams.opponent)
+        game_options['rng'] = streams.game
+    game = Game({
+        'epsilon': agent,
+        'random': opponent
+    }, **game_options)
+    game.play()
+    winner, score = game.get_winner()
+    current_game_stats = game.get_stats()
+    subjective_current_game_stats = dominion_stats_to_game_stats(
+        current_game_stats, 'epsilon')
+    if winner == 'epsilon':
+        return_ = 1
+    else:
+        return_ = -1
+    if replay is not None:
+        replay.append(agent.get_events(), agent.get_event_decisions(), return_)
+    return subjective_current_game_stats, agent.get_decisions(), return_
+
+
+def _play_batch(task):
+    """Worker side of parallel evaluation. Plays a batch of games and
+    returns their stats along with TargetRuns recording the returns
+    observed for each state action pair"""
+    (payload, first_game, games, instrument, seed, replay_names,
+     engine_options) = task
+    policy, opponent, projection = pickle.loads(payload)
+    instrumentation = Instrumentation() if instrument else None
+    recorder = None if replay_names is None else EpisodeRecorder(replay_names)
+    partial = TargetRuns()
+    batch_stats = []
+    for game in range(first_game, first_game + games):
+        streams = None if seed is None else game_streams(seed, game)
+        game_stats, decisions, return_ = play_episode(
+            policy, opponent, instrumentation, streams, recorder,
+            engine_options, projection)
+        batch_stats.append(game_stats)
+        _learn([partial], decisions, return_, instrumentation)
+    records = None if recorder is None else recorder.records
+    return batch_stats, partial, instrumentation, records
+
+
+def _report(stats, first_game, last_game, all_stats,
+            estimators, instrumentation, metrics):
+    print('stats for games {} to {}'.format(first_game, last_game))
+    summary = stats.summarise()
+    for stat, value in summary.items():
+        print('{} = {}'.format(stat, value))
+    all_stats.append(summary)
+    if metrics is not None:
+        metrics.write_window(summary)
+    if instrumentation is not None:
+        instrumentation.record_table_size(
+            last_game + 1, [len(estimator) for estimator in estimators])
+        instrumentation.report()
+    return summary
+
+
+def _learn(estimators, decisions, return_, instrumentation):
+    targets = [return_] * len(decisions)
+    if instrumentation is None:
+        for estimator in estimators:
+            estimator.learn_batch(decisions, targets)
+    else:
+        start = time.perf_counter()
+        for estimator in estimators:
+            estimator.learn_batch(decisions, targets)
+        instrumentation.add('learn_batch',
+                            time.perf_counter() - start,
+                            len(estimators) * len(decisions))
+
+
 def mc_evaluate(estimators,
                 policy,
                 opponent,
                 games=1000,
-                games_between_stats=100):
+                games_between_stats=100,
+                workers=None,
+                batch_size=50,
+                instrumentation=None,
+                metrics=None,
+                stop=None,
+                seed=None,
+                replay=None,
+                engine_options=None,
+                projection=None,
+                first_game=0):
+    """Play games of the policy against the opponent, teaching the
+    estimators the returns of the policy's decisions. If an
+    instrumentation.Instrumentation is given, per phase timings are
+    accumulated in it and reported along with the stats. If a
+    telemetry.MetricsWriter is given, the stats of each window are
+    appended to its file. If stop is given, it is called with the summary
+    of each stats window, and the evaluation ends early once it returns
+    True, e.g. the add method of an evaluation.SequentialWinRateTest.
+
+    If a seed is given, every game draws from its own streams derived
+    from the seed and the index of the game, so a run is reproduced
+    exactly by the same seed. Parallel runs are reproduced regardless of
+    the number of workers, but differ from serial runs, in which the
+    policy learns after every game rather than every window. Games are
+    numbered from first_game, so a run can be continued by another call
+    without replaying the streams of the games already played.
+
+    If a replay.ReplayWriter is given, every episode is appended to its
+    log, so that estimators can be trained on them again later. The
+    writer is flushed when the evaluation ends, also if it ends early or
+    with an error, and closing it is left to the caller.
+
+    engine_options are passed on to the engine's GameState. With
+    treasures='auto' and skip_forced=True, only the decisions that matter
+    are made, and learned from. projection is passed on to play_episode."""
+    try:
+        if workers:
+            return _mc_evaluate_parallel(
+                estimators, policy, opponent, games, games_between_stats,
+                workers, batch_size, instrumentation, metrics, stop, seed,
+                replay, engine_options, projection, first_game)
+        return _mc_evaluate_serial(
+            estimators, policy, opponent, games, games_between_stats,
+            instrumentation, metrics, stop, seed, replay, engine_options,
+            projection, first_game)
+    finally:
+        if replay is not None and hasattr(replay, 'flush'):
+            replay.flush()
+
+
+def _mc_evaluate_serial(estimators,
+                        policy,
+                        opponent,
+                        games,
+                        games_between_stats,
+                        instrumentation,
+                        metrics,
+                        stop,
+                        seed,
+                        replay,
+                        engine_options,
+                        projection,
+                        first_game):
     all_stats = []
-    for i in range(games):
-        if i % games_between_stats == 0:
+    for i in range(first_game, first_game + games):
+        if (i - first_game) % games_between_stats == 0:
             stats = Stats()
-        agent = AgentWithLatestObservationAsState(policy, ignore_player_and_turn_projection)
-        game = Game({
-            'epsilon': agent,
-            'random': opponent
-        })
-        game.play()
-        winner, score = game.get_winner()
-        current_game_stats = game.get_stats()
-        subjective_current_game_stats = dominion_stats_to_game_stats(
-            current_game_stats, 'epsilon')
-        stats.add_game(subjective_current_game_stats)
-        if winner == 'epsilon':
-            return_ = 1
-        else:
-            return_ = -1
-        for estimator in estimators:
-            for S, A in agent.get_decisions():  # TODO split responsibilities
-                estimator.learnFrom(S, A, return_)
-        if (i + 1) % games_between_stats == 0:
-            print('stats for games {} to {}'.format(
-                i - games_between_stats + 1,
-                i))
-            for stat, value in stats.summarise().items():
-                print('{} = {}'.format(stat, value))
-            all_stats.append(stats.summarise())
+        streams = None if seed is None else game_streams(seed, i)
+        game_stats, decisions, return_ = play_episode(
+            policy, opponent, instrumentation, streams, replay,
+            engine_options, projection)
+        stats.add_game(game_stats)
+        _learn(estimators, decisions, return_, instrumentation)
+        if (i + 1 - first_game) % games_between_stats == 0:
+            summary = _report(stats, i - games_between_stats + 1, i,
+                              all_stats, estimators, instrumentation, metrics)
+            if stop is not None and stop(summary):
+                break
     return all_stats
 
 
-def improve_via_self_play():
-    total_games = 100000
-    opponent = RandomPlayer()
-    estimator = TabularQEstimator()
-    old_estimator = None
-    policy = EpsilonSoft(0.1, Greedy(estimator))
-    games_between_stats = 1000
-    game = 0
+def _mc_evaluate_parallel(estimators,
+                          policy,
+                          opponent,
+                          games,
+                          games_between_stats,
+                          workers,
+                          batch_size,
+                          instrumentation,
+                          metrics,
+                          stop,
+                          seed,
+                          replay,
+                          engine_options,
+                          projection,
+                          first_game):
+    """Plays the games in batches in a pool of worker processes. The policy
+    and the opponent are shipped to the workers once per stats window, so
+    the policy being evaluated is refreshed from the estimators between
+    windows rather than after every game."""
     all_stats = []
-    while game < total_games:
-        stats = mc_evaluate(
-            [estimator],
-            policy=policy,
-            opponent=opponent,
-            games=5000,
-            games_between_stats=games_between_stats)
-        for stat_entry in stats:
-            game += stat_entry['games']
-        all_stats.extend(stats)
-        print('current estimator')
-        print(estimator)
-        print('old estimator')
-        print(old_estimator)
-        if (stats[-1]['win_rate'] > 0.65):
-            old_estimator = estimator
-            opponent = AgentWithLatestObservationAsState(
-                EpsilonSoft(0.1, Greedy(old_estimator)),
-                ignore_player_and_turn_projection)
-            policy = EpsilonSoft(0.1, Greedy(old_estimator))
-            estimator = TabularQEstimator()
-            print('Win rate of over 65% reached.')
+    with Pool(workers) as pool:
+        for window_start in range(first_game, first_game + games,
+                                  games_between_stats):
+            window = min(games_between_stats,
+                         first_game + games - window_start)
+            payload = pickle.dumps((policy, opponent, projection))
+            tasks = [(payload,
+                      window_start + start,
+                      min(batch_size, window - start),
+                      instrumentation is not None,
+                      seed,
+                      None if replay is None else replay.names,
+                      engine_options)
+                     for start in range(0, window, batch_size)]
+            stats = Stats()
+            results = pool.map(_play_batch, tasks)
+            for (batch_stats, partial, batch_instrumentation,
+                 records) in results:
+                for game_stats in batch_stats:
+                    stats.add_game(game_stats)
+                for record in records or ():
+                    replay.write(record)
+                start = time.perf_counter()
+                for estimator in estimators:
+                    estimator.merge(partial)
+                if instrumentation is not None:
+                    instrumentation.add('merge', time.perf_counter() - start)
+                    instrumentation.merge(batch_instrumentation)
+            if window == games_between_stats:
+                summary = _report(stats,
+                                  window_start,
+                                  window_start + games_between_stats - 1,
+                                  all_stats,
+                                  estimators,
+                                  instrumentation,
+                                  metrics)
+                if stop is not None and stop(summary):
+                    break
+    return all_stats
+
+
+class SelfPlayTrainer:
+    """Learns to play by playing blocks of up to block_games games against
+    an opponent, initially a random player, with an epsilon soft policy.
+    A block can end early once a SequentialWinRateTest of its games
+    settles, after at least test_games games. If the win rate of the block
+    is then above threshold, as decided by the test, the
+    estimator becomes the opponent's and the policy's, and learning starts
+    again with a new estimator from new_estimator.
+
+    Blocks are made of whole stats windows, so block_games must be a
+    multiple of games_between_stats.
+
+    train can be called again to continue, and the trainer can be pickled
+    in between, e.g. to continue in another process. Games draw from
+    streams of the seed by their index, so training in steps of whole
+    stats windows gives the same result as training in one go."""
+    def __init__(self,
+                 new_estimator=TabularQEstimator,
+                 epsilon=0.1,
+                 threshold=0.65,
+                 projection=None,
+                 block_games=5000,
+                 games_between_stats=1000,
+                 test_games=1000,
+                 seed=None,
+                 workers=None,
+                 metrics=None,
+                 engine_options=None):
+        if block_games % games_between_stats:
+            raise ValueError('block_games must be a multiple of '
+                             'games_between_stats')
+        self._new_estimator = new_estimator
+        self._epsilon = epsilon
+        self._threshold = threshold
+        self._projection = (ignore_player_and_turn_projection
+                            if projection is None else projection)
+        self._block_games = block_games
+        self._games_between_stats = games_between_stats
+        self._test_games = test_games
+        self._seed = seed
+        self._workers = workers
+        self._engine_options = engine_options
+        self.metrics = metrics
+        self.estimator = new_estimator()
+        self.old_estimator = None
+        self.acting_estimator = self.estimator
+        self.opponent = RandomPlayer()
+        self.generation = 0
+        self.game = 0
+        self._test = None
+        self._block_played = 0
+        if metrics is not None:
+            metrics.context['generation'] = 0
+
+    def train(self, games, on_block_end=None):
+        """Play until games games have been played in all, rounded up to
+        whole stats windows, and return the summaries of the windows
+        played. on_block_end is called with the test of each block that
+        ends, before the opponent is replaced."""
+        window = self._games_between_stats
+        games = -(-games // window) * window
+        all_stats = []
+        while self.game < games:
+            if self._test is None:
+                self._test = SequentialWinRateTest(
+                    self._threshold,
+                    min_games=self._test_games,
+                    max_games=self._block_games)
+                self._block_played = 0
+            stats = mc_evaluate(
+                [self.estimator],
+                policy=EpsilonSoft(self._epsilon,
+                                   Greedy(self.acting_estimator)),
+                opponent=self.opponent,
+                games=min(self._block_games - self._block_played,
+                          games - self.game),
+                games_between_stats=window,
+                workers=self._workers,
+                metrics=self.metrics,
+                stop=self._test.add,
+                seed=self._seed,
+                engine_options=self._engine_options,
+                projection=self._projection,
+                first_game=self.game)
+            played = sum(summary['games'] for summary in stats)
+            self.game += played
+            self._block_played += played
+            all_stats.extend(stats)
+            if (self._test.decision is not None
+                    or self._block_played >= self._block_games):
+                self._end_block(on_block_end)
+        return all_stats
+
+    def _end_block(self, on_block_end):
+        test = self._test
+        self._test = None
+        if on_block_end is not None:
+            on_block_end(test)
+        if test.above_threshold():
+            snapshot = getattr(self.estimator, 'snapshot', None)
+            self.old_estimator = (snapshot() if snapshot is not None
+                                  else copy.deepcopy(self.estimator))
+            self.acting_estimator = self.old_estimator
+            self.opponent = AgentWithLatestObservationAsState(
+                EpsilonSoft(self._epsilon, Greedy(self.old_estimator)),
+                self._projection)
+            self.estimator = self._new_estimator()
+            self.generation += 1
+            if self.metrics is not None:
+                self.metrics.context['generation'] = self.generation
+            print('Win rate of over {:.0%} reached.'.format(self._threshold))
             print('Making the current policy the opponent')
         else:
-            policy = EpsilonSoft(0.1, Greedy(estimator))
-    x_values = range(
-        0,
-        games_between_stats * len(all_stats),
-        games_between_stats)
-    plt.plot(
-        x_values,
-        list(map(lambda s: s['average_turns'], all_stats)),
-        label='turns')
-    plt.plot(
-        x_values,
-        list(map(lambda s: s['average_score'], all_stats)),
-        label='winning score')
-    plt.plot(
-        x_values,
-        list(map(lambda s: s['win_rate'] * 100, all_stats)),
-        label='win rate')
-    plt.xlabel('game')
-    plt.legend()
+            self.acting_estimator = self.estimator
+
+
+def improve_via_self_play(workers=None):
+    total_games = 100000
     now = datetime.now()
     now = now.replace(microsecond=0)
     timestamp = now.isoformat()
-    plt.savefig('results/learning-results-' + timestamp + '.png')
+    metrics = MetricsWriter('results/learning-metrics-' + timestamp + '.jsonl')
+    trainer = SelfPlayTrainer(workers=workers, metrics=metrics)
+
+    def report(test):
+        test.report()
+        plot_metrics(metrics.path,
+                     'results/learning-results-' + timestamp + '.png')
+        print('current estimator')
+        trainer.estimator.write_report(
+            sys.stdout, max_states=20, max_actions=5)
+        print()
+        print('old estimator')
+        if trainer.old_estimator is not None:
+            trainer.old_estimator.write_report(
+                sys.stdout, max_states=20, max_actions=5)
+        print()
+
+    trainer.train(total_games, on_block_end=report)
+    old_estimator = trainer.old_estimator
+    estimator = trainer.estimator
     with open('models/final-models-' + timestamp + '.p', 'wb') as file:
         pickle.dump(
             {
                 'old_estimator': old_estimator,
                 'latest_estimator': estimator
             }, file)
+    if old_estimator is not None:
+        model_format.save(
+            old_estimator,
+            'models/final-models-' + timestamp + '.old_estimator.qtab')
+    model_format.save(
+        estimator,
+        'models/final-models-' + timestamp + '.latest_estimator.qtab')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,300 @@
+"""A compact, versioned binary format for tabular Q models that can be
+used through mmap without loading the table into memory.
+
+A file holds one table. After a fixed size header come 8-byte aligned
+sections:
+
+    state_offsets   uint64[states + 1]   offsets of each state in state_blob
+    state_blob      bytes                encoded states
+    action_offsets  uint64[actions + 1]  offsets of each action in action_blob
+    action_blob     bytes                encoded actions
+    state_index     uint32[slots]        open addressing hash index of the
+                                         states by crc32, storing id + 1
+    entry_offsets   uint64[states + 1]   entries of state i are the range
+                                         entry_offsets[i]:entry_offsets[i + 1]
+    entry_action    uint32[entries]      action id of each entry
+    entry_n         int64[entries]       occurrence count of each entry
+    entry_q         float64[entries]     average target of each entry
+
+    python model_format.py models/final-models-<timestamp>.p
+
+converts the pickled estimators saved by learn.py, writing one
+<pickle name>.<estimator name>.qtab file per estimator."""
+from ast import literal_eval
+from collections import defaultdict
+from enum import Enum
+import mmap
+import os
+import pickle
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from dominion import ChoiceType
+from estimators import QEstimatorBase, _estimator_items
+
+MAGIC = b'DOMQTAB\x00'
+VERSION = 1
+
+_header = struct.Struct('<8sII' + 'Q' * 4 + 'Q' * 9)
+_sections = ('state_offsets', 'state_blob', 'action_offsets', 'action_blob',
+             'state_index', 'entry_offsets', 'entry_action', 'entry_n',
+             'entry_q')
+_dtypes = {
+    'state_offsets': np.uint64,
+    'state_blob': np.uint8,
+    'action_offsets': np.uint64,
+    'action_blob': np.uint8,
+    'state_index': np.uint32,
+    'entry_offsets': np.uint64,
+    'entry_action': np.uint32,
+    'entry_n': np.int64,
+    'entry_q': np.float64,
+}
+
+
+def encode_state(state):
+    if isinstance(state, str):
+        return b'S' + state.encode('utf-8')
+    return b'R' + repr(state).encode('utf-8')
+
+
+def decode_state(data):
+    if data[:1] == b'S':
+        return data[1:].decode('utf-8')
+    return literal_eval(data[1:].decode('utf-8'))
+
+
+def encode_action(action):
+    return '\x1f'.join(
+        part.name if isinstance(part, Enum) else str(part)
+        for part in action).encode('utf-8')
+
+
+def decode_action(data):
+    action_type, *params = data.decode('utf-8').split('\x1f')
+    return (ChoiceType[action_type], *params)
+
+
+def _slot_count(states):
+    slots = 8
+    while slots < 2 * states:
+        slots *= 2
+    return slots
+
+
+def _pack_strings(encoded):
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def save(estimator, path):
+    """Write the entries of a tabular estimator to path. Raises TypeError
+    for estimators without a table, such as LinearQEstimator."""
+    actions_by_state = defaultdict(list)
+    for (S, A), (n, q) in _estimator_items(estimator):
+        actions_by_state[S].append((A, n, q))
+    states = list(actions_by_state.keys())
+    action_ids = {}
+    for entries in actions_by_state.values():
+        for A, _, _ in entries:
+            action_ids.setdefault(A, len(action_ids))
+    encoded_states = [encode_state(S) for S in states]
+
+    slots = _slot_count(len(states))
+    state_index = np.zeros(slots, dtype=np.uint32)
+    for state_id, data in enumerate(encoded_states):
+        slot = zlib.crc32(data) & (slots - 1)
+        while state_index[slot]:
+            slot = (slot + 1) & (slots - 1)
+        state_index[slot] = state_id + 1
+
+    entry_offsets = np.zeros(len(states) + 1, dtype=np.uint64)
+    entry_action, entry_n, entry_q = [], [], []
+    for state_id, S in enumerate(states):
+        entries = sorted(actions_by_state[S],
+                         key=lambda entry: action_ids[entry[0]])
+        for A, n, q in entries:
+            entry_action.append(action_ids[A])
+            entry_n.append(n)
+            entry_q.append(q)
+        entry_offsets[state_id + 1] = len(entry_action)
+
+    state_offsets, state_blob = _pack_strings(encoded_states)
+    action_offsets, action_blob = _pack_strings(
+        [encode_action(A) for A in action_ids])
+    arrays = {
+        'state_offsets': state_offsets,
+        'state_blob': state_blob,
+        'action_offsets': action_offsets,
+        'action_blob': action_blob,
+        'state_index': state_index,
+        'entry_offsets': entry_offsets,
+        'entry_action': np.array(entry_action, dtype=np.uint32),
+        'entry_n': np.array(entry_n, dtype=np.int64),
+        'entry_q': np.array(entry_q, dtype=np.float64),
+    }
+    offsets = []
+    position = _header.size
+    for name in _sections:
+        position = (position + 7) // 8 * 8
+        offsets.append(position)
+        position += arrays[name].nbytes
+    header = _header.pack(MAGIC, VERSION, 0,
+                          len(states), len(action_ids), len(entry_action),
+                          slots, *offsets)
+    with open(path, 'wb') as file:
+        file.write(header)
+        for name, offset in zip(_sections, offsets):
+            file.write(b'\x00' * (offset - file.tell()))
+            file.write(arrays[name].tobytes())
+
+
+class MappedQEstimator(QEstimatorBase):
+    """A read-only estimator backed by a memory mapped model file. Opening
+    one only reads the header and the small table of actions, and processes
+    that open the same file share its pages. Pickling one pickles just the
+    path, so it can be sent to worker processes cheaply."""
+    def __init__(self, path, cache_size=4096):
+        self._path = os.path.abspath(path)
+        self._cache_size = cache_size
+        self._open()
+
+    def _open(self):
+        with open(self._path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self._state_count, action_count, entry_count,
+         self._slots, *offsets) = _header.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a Q model file'.format(self._path))
+        if version != VERSION:
+            raise ValueError('Unsupported Q model file version {}'.format(
+                version))
+        counts = {
+            'state_offsets': self._state_count + 1,
+            'action_offsets': action_count + 1,
+            'state_index': self._slots,
+            'entry_offsets': self._state_count + 1,
+            'entry_action': entry_count,
+            'entry_n': entry_count,
+            'entry_q': entry_count,
+        }
+        arrays = {}
+        for name, offset in zip(_sections, offsets):
+            if name in counts:
+                arrays[name] = np.frombuffer(
+                    self._mmap, dtype=_dtypes[name],
+                    count=counts[name], offset=offset)
+        for name, offsets_name in (('state_blob', 'state_offsets'),
+                                   ('action_blob', 'action_offsets')):
+            offset = offsets[_sections.index(name)]
+            arrays[name] = np.frombuffer(
+                self._mmap, dtype=np.uint8,
+                count=int(arrays[offsets_name][-1]), offset=offset)
+        self._arrays = arrays
+        action_offsets = arrays['action_offsets']
+        action_blob = arrays['action_blob']
+        self._action_ids = {
+            decode_action(action_blob[action_offsets[i]:
+                                      action_offsets[i + 1]].tobytes()): i
+            for i in range(action_count)}
+        self._state_ranges = {}
+
+    def _state_range(self, S):
+        cached = self._state_ranges.get(S, False)
+        if cached is not False:
+            return cached
+        data = encode_state(S)
+        arrays = self._arrays
+        state_index = arrays['state_index']
+        state_offsets = arrays['state_offsets']
+        state_blob = arrays['state_blob']
+        mask = self._slots - 1
+        slot = zlib.crc32(data) & mask
+        found = None
+        while state_index[slot]:
+            state_id = int(state_index[slot]) - 1
+            start = int(state_offsets[state_id])
+            end = int(state_offsets[state_id + 1])
+            if state_blob[start:end].tobytes() == data:
+                found = (int(arrays['entry_offsets'][state_id]),
+                         int(arrays['entry_offsets'][state_id + 1]))
+                break
+            slot = (slot + 1) & mask
+        if len(self._state_ranges) >= self._cache_size:
+            self._state_ranges.clear()
+        self._state_ranges[S] = found
+        return found
+
+    def predict(self, S, A):
+        return float(self.predict_many(S, [A])[0])
+
+    def predict_many(self, S, actions):
+        values = np.zeros(len(actions))
+        state_range = self._state_range(S)
+        if state_range is None:
+            return values
+        start, end = state_range
+        entry_actions = self._arrays['entry_action'][start:end]
+        entry_q = self._arrays['entry_q'][start:end]
+        for i, A in enumerate(actions):
+            action_id = self._action_ids.get(A)
+            if action_id is None:
+                continue
+            position = np.searchsorted(entry_actions, action_id)
+            if (position < len(entry_actions)
+                    and entry_actions[position] == action_id):
+                values[i] = entry_q[position]
+        return values
+
+    def learnFrom(self, S, A, target):
+        raise TypeError('Mapped Q models are read-only')
+
+    def items(self):
+        arrays = self._arrays
+        actions = {i: A for A, i in self._action_ids.items()}
+        state_offsets = arrays['state_offsets']
+        entry_offsets = arrays['entry_offsets']
+        for state_id in range(self._state_count):
+            S = decode_state(arrays['state_blob'][
+                state_offsets[state_id]:state_offsets[state_id + 1]].tobytes())
+            for entry in range(int(entry_offsets[state_id]),
+                               int(entry_offsets[state_id + 1])):
+                yield ((S, actions[int(arrays['entry_action'][entry])]),
+                       (int(arrays['entry_n'][entry]),
+                        float(arrays['entry_q'][entry])))
+
+    def __len__(self):
+        return len(self._arrays['entry_q'])
+
+    def __getstate__(self):
+        return {'_path': self._path, '_cache_size': self._cache_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+def convert_pickle(path):
+    """Convert the dict of estimators pickled by learn.py into one model
+    file per estimator, and return the paths of the written files"""
+    with open(path, 'rb') as file:
+        estimators = pickle.load(file)
+    base, _ = os.path.splitext(path)
+    written = []
+    for name, estimator in estimators.items():
+        if estimator is None:
+            continue
+        output = '{}.{}.qtab'.format(base, name)
+        save(estimator, output)
+        written.append(output)
+    return written
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        for output in convert_pickle(path):
+            print(output)
@@ -1,3 +1,11 @@
 from collections import namedtuple
+from enum import Enum
 
-Observation = namedtuple('Observation', 'audience private public')
+EventType = Enum('EventType', 'start_turn draw play buy')
+
+Observation = namedtuple('Observation', 'type actor card coins turn')
+
+# What a player consumes of the observations: none at all, only the latest
+# one before each of its choices, all of them, or all of them as seen by
+# the other players
+Interest = Enum('Interest', 'nothing latest stream public')
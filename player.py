@@ -1,4 +1,9 @@
 import random
+import time
+
+from dominion import ChoiceType, render_observation
+from observation import Interest
+from seeding import global_random
 
 
 class HumanPlayer:
@@ -20,28 +25,46 @@ class HumanPlayer:
 
 
 class RandomPlayer:
-    def __init__(self, print_observations=False):
+    def __init__(self, print_observations=False, rng=global_random):
         self._print_observations = print_observations
+        self._rng = rng
+        self.interest = (Interest.stream if print_observations
+                         else Interest.nothing)
+
+    def reseed(self, rng):
+        self._rng = rng
 
     def observation(self, observation):
         if self._print_observations:
             print(observation)
 
+    def observe_event(self, observation, private):
+        if self._print_observations:
+            print(render_observation(observation, private))
+
     def choose(self, actions):
-        return random.randrange(len(actions))
+        return self._rng.randrange(len(actions))
 
 
 class ObservationIgnoringAgent:
     """An agent that ignores observations given to it, and passes
     an empty tuple as the state to the policy function given
     to the constructor. Acts according to the policy."""
+    interest = Interest.nothing
+
     def __init__(self, policy):
         self._policy = policy
         self._decisions = []
 
+    def reseed(self, rng):
+        self._policy.reseed(rng)
+
     def observation(self, observation):
         pass
 
+    def observe_event(self, observation, private):
+        pass
+
     def choose(self, actions):
         choice = self._policy.choose((), actions)
         self._decisions.append(((), actions[choice]))
@@ -57,20 +80,145 @@ def identity_projection(state):
 
 class AgentWithLatestObservationAsState:
     """An agent that assumes that the latest observation is the state.
-    Passes this and the choices to the policy and acts accordingly."""
-    def __init__(self, policy, projection=identity_projection):
+    Passes this and the choices to the policy and acts accordingly.
+
+    It only needs the latest observation before each choice. If
+    record_events is set, all structured observations are taken and kept,
+    along with the number of them seen before each decision, so that the
+    episode can be stored, e.g. in a replay.ReplayWriter."""
+    def __init__(self, policy, projection=identity_projection,
+                 record_events=False):
         self._policy = policy
         self._decisions = []
         self._state = ()
         self._projection = projection
+        self._events = [] if record_events else None
+        self._event_decisions = []
+        self.interest = Interest.stream if record_events else Interest.latest
+
+    def reseed(self, rng):
+        self._policy.reseed(rng)
+
+    def reset(self):
+        """Forget the episode played so far, to play another one"""
+        self._decisions = []
+        self._state = ()
+        if self._events is not None:
+            self._events = []
+        self._event_decisions = []
 
     def observation(self, observation):
         self._state = self._projection(observation)
 
+    def observe_event(self, observation, private):
+        if self._events is not None:
+            self._events.append((observation, private))
+        project_event = getattr(self._projection, 'project_event', None)
+        if project_event:
+            self._state = project_event(observation, private)
+        else:
+            self._state = self._projection(
+                render_observation(observation, private))
+
     def choose(self, actions):
         choice = self._policy.choose(self._state, actions)
         self._decisions.append((self._state, actions[choice]))
+        if self._events is not None:
+            self._event_decisions.append((len(self._events), actions[choice]))
         return choice
 
     def get_decisions(self):
         return self._decisions
+
+    def get_events(self):
+        return self._events
+
+    def get_event_decisions(self):
+        return self._event_decisions
+
+
+_big_money_buys = ['province', 'gold', 'silver']
+
+
+def big_money(actions):
+    """The index of the action a big money strategy takes: play every
+    treasure, then buy the best of province, gold and silver that can be
+    afforded, if any"""
+    best = None
+    for i, action in enumerate(actions):
+        if action[0] in (ChoiceType.play, ChoiceType.play_treasures):
+            return i
+        if action[0] == ChoiceType.buy and action[1] in _big_money_buys:
+            if (best is None or _big_money_buys.index(action[1])
+                    < _big_money_buys.index(actions[best][1])):
+                best = i
+    if best is None:
+        return len(actions) - 1
+    return best
+
+
+class RolloutPlayer:
+    """An agent that evaluates its buy choices by playing the game out
+    from clones of the game state, with both players following the big
+    money strategy. Each buy and ending the turn get up to playouts
+    playouts, in rounds, until time_budget seconds have passed, and the
+    one winning most often is chosen, preferring the big money choice on
+    ties. All alternatives in a round are played out with the same random
+    stream, to compare them under the same luck. Treasures are always
+    played.
+
+    The game attaches its state to the player, so the game must use an
+    engine whose GameState can be cloned, such as fast_dominion."""
+    interest = Interest.nothing
+
+    def __init__(self, playouts=20, time_budget=0.1, rng=global_random):
+        self._playouts = playouts
+        self._time_budget = time_budget
+        self._rng = rng
+        self._game_state = None
+        self._name = None
+
+    def reseed(self, rng):
+        self._rng = rng
+
+    def attach(self, game_state, name):
+        if not hasattr(game_state, 'clone'):
+            raise TypeError('RolloutPlayer needs a game state that can be '
+                            'cloned, e.g. from the fast_dominion engine')
+        self._game_state = game_state
+        self._name = name
+
+    def observation(self, observation):
+        pass
+
+    def observe_event(self, observation, private):
+        pass
+
+    def choose(self, actions):
+        if len(actions) == 1 or any(
+                action[0] in (ChoiceType.play, ChoiceType.play_treasures)
+                for action in actions):
+            return big_money(actions)
+        deadline = time.perf_counter() + self._time_budget
+        wins = [0] * len(actions)
+        played = 0
+        while played < self._playouts and time.perf_counter() < deadline:
+            seed = self._rng.getrandbits(64)
+            for i, action in enumerate(actions):
+                wins[i] += self._playout(action, seed)
+            played += 1
+        best = big_money(actions)
+        for i, action_wins in enumerate(wins):
+            if action_wins > wins[best]:
+                best = i
+        return best
+
+    def _playout(self, action, seed):
+        state = self._game_state.clone(random.Random(seed),
+                                       determinize_for=self._name)
+        _, choice = state.get_next_choice(action)
+        while not state.is_game_over():
+            _, choice = state.get_next_choice(
+                choice.alternatives[big_money(choice.alternatives)])
+        winner, _ = state.get_winner()
+        return winner == self._name
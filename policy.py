@@ -1,4 +1,6 @@
-from random import random, randrange
+import numpy as np
+
+from seeding import global_random
 
 
 class Policy:
@@ -6,33 +8,48 @@ class Policy:
     def choose(self, S, actions):
         raise NotImplementedError()
 
+    def reseed(self, rng):
+        """Draw any random decisions from rng from now on"""
+        pass
+
 
 class Greedy(Policy):
     """A policy that acts greedily based on a given estimate for
-    the action value function Q"""
-    def __init__(self, q_estimator):
+    the action value function Q. Ties are broken in favour of the first
+    of the best actions, or uniformly at random among them if ties is
+    'random'."""
+    def __init__(self, q_estimator, ties='first', rng=global_random):
+        if ties not in ('first', 'random'):
+            raise ValueError('Unknown tie breaking rule: {}'.format(ties))
         self._estimator = q_estimator
+        self._ties = ties
+        self._rng = rng
+
+    def reseed(self, rng):
+        self._rng = rng
 
     def choose(self, S, actions):
-        best = self._estimator.predict(S, actions[0])
-        best_i = 0
-        for i, action in enumerate(actions):
-            Q = self._estimator.predict(S, action)
-            if Q > best:
-                best_i = i
-                best = Q
-        return best_i
+        values = self._estimator.predict_many(S, actions)
+        if self._ties == 'random':
+            best = np.flatnonzero(values == values.max())
+            return int(best[self._rng.randrange(len(best))])
+        return int(values.argmax())
 
 
 class EpsilonSoft(Policy):
     """A policy that explores randomly with probability epsilon, and otherwise
     follows any given policy (often greedy policy in practice)"""
-    def __init__(self, epsilon, policy):
+    def __init__(self, epsilon, policy, rng=global_random):
         self._epsilon = epsilon
         self._policy = policy
+        self._rng = rng
+
+    def reseed(self, rng):
+        self._rng = rng
+        self._policy.reseed(rng)
 
     def choose(self, S, actions):
-        if random() < self._epsilon:
-            return randrange(len(actions))
+        if self._rng.random() < self._epsilon:
+            return self._rng.randrange(len(actions))
         else:
             return self._policy.choose(S, actions)
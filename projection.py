@@ -0,0 +1,145 @@
+import re
+
+
+class RegexProjection:
+    """A projection of an observation string into a state string that
+    applies a sequence of precompiled regular expression substitutions"""
+    def __init__(self, substitutions):
+        self._substitutions = [(re.compile(pattern), replacement)
+                               for pattern, replacement in substitutions]
+
+    def __call__(self, state):
+        for pattern, replacement in self._substitutions:
+            state = pattern.sub(replacement, state)
+        return state
+
+    def then(self, other):
+        return compose(self, other)
+
+
+class ComposedProjection:
+    """A projection that applies the given projections in order"""
+    def __init__(self, projections):
+        self._projections = projections
+
+    def __call__(self, state):
+        for projection in self._projections:
+            state = projection(state)
+        return state
+
+    def then(self, other):
+        return compose(self, other)
+
+
+def compose(*projections):
+    """Chain projections, fusing consecutive regex projections into one"""
+    flattened = []
+    for projection in projections:
+        if isinstance(projection, ComposedProjection):
+            flattened.extend(projection._projections)
+        else:
+            flattened.append(projection)
+    fused = []
+    for projection in flattened:
+        if (fused
+                and isinstance(projection, RegexProjection)
+                and isinstance(fused[-1], RegexProjection)):
+            combined = RegexProjection([])
+            combined._substitutions = (fused[-1]._substitutions
+                                       + projection._substitutions)
+            fused[-1] = combined
+        else:
+            fused.append(projection)
+    if len(fused) == 1:
+        return fused[0]
+    return ComposedProjection(fused)
+
+
+class MemoizedProjection:
+    """Caches the results of a projection. The number of distinct
+    observations is small compared to the number delivered, so most
+    projections become a single dict lookup.
+
+    Text observations are cached by the raw string. Structured observations
+    are cached by the record and whether it was seen privately. On a cache
+    miss they are projected by event_projection, which works on the fields
+    of the record, if one is given, and otherwise rendered to text (using
+    the given render function) and projected as text. Once maxsize results
+    are cached, the oldest ones are dropped."""
+    def __init__(self, projection, render=None, maxsize=4096,
+                 event_projection=None):
+        self._projection = projection
+        self._render = render
+        self._event_projection = event_projection
+        self._maxsize = maxsize
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, state):
+        try:
+            projected = self._cache[state]
+        except KeyError:
+            self.misses += 1
+            projected = self._projection(state)
+            self._store(state, projected)
+            return projected
+        self.hits += 1
+        return projected
+
+    def project_event(self, observation, private):
+        key = (observation, private)
+        try:
+            projected = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            if self._event_projection is not None:
+                projected = self._event_projection(observation, private)
+            else:
+                projected = self._projection(
+                    self._render(observation, private))
+            self._store(key, projected)
+            return projected
+        self.hits += 1
+        return projected
+
+    def cache_info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._cache),
+            'maxsize': self._maxsize,
+        }
+
+    def clear(self):
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def then(self, other):
+        event_projection = self._event_projection
+        if event_projection is not None:
+            event_projection = _ProjectedEvents(event_projection, other)
+        return MemoizedProjection(
+            compose(self._projection, other), self._render, self._maxsize,
+            event_projection)
+
+    def _store(self, key, projected):
+        if len(self._cache) >= self._maxsize:
+            del self._cache[next(iter(self._cache))]
+        self._cache[key] = projected
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+
+class _ProjectedEvents:
+    """An event projection followed by a text projection"""
+    def __init__(self, event_projection, projection):
+        self._event_projection = event_projection
+        self._projection = projection
+
+    def __call__(self, observation, private):
+        return self._projection(self._event_projection(observation, private))
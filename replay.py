@@ -0,0 +1,283 @@
+"""An append-only binary log of episodes, for re-training estimators on
+stored games instead of simulating them again.
+
+A log starts with a header holding the player names that actor indices
+refer to. Episodes follow, each of them
+
+    record header   uint32 record length, uint32 events, uint32 decisions,
+                    float32 return
+    events          8 bytes per structured observation, as seen by the
+                    agent: type, actor, private, card, coins and turn, with
+                    -1 for the fields the event type does not have
+    decisions       5 bytes per decision: the number of events observed
+                    before it, and the code of the chosen action, an index
+                    of replay.actions
+
+Logs are read through mmap, so they can be larger than memory.
+
+    python replay.py record <log> [games]
+    python replay.py refit <log>
+
+records games of an epsilon greedy learner against a random player, or
+re-fits a fresh estimator from a log and reports how long it took."""
+from contextlib import redirect_stdout
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from dominion import render_observation
+from fast_dominion import play_actions, buy_actions, END_TURN, PLAY_TREASURES
+from observation import Observation, EventType
+
+MAGIC = b'DOMRPLY\x00'
+VERSION = 2
+
+# Codes of existing actions do not change when cards are added
+actions = [END_TURN, PLAY_TREASURES] + [
+    action for play, buy in zip(play_actions, buy_actions)
+    for action in (play, buy)]
+
+action_codes = {action: code for code, action in enumerate(actions)}
+
+_event_types = list(EventType)
+
+_file_header = struct.Struct('<8sII')
+_names_size = 248
+_record_header = struct.Struct('<IIIf')
+
+event_dtype = np.dtype([('type', 'u1'), ('actor', 'u1'), ('private', 'u1'),
+                        ('card', 'i1'), ('coins', '<i2'), ('turn', '<i2')])
+
+decision_dtype = np.dtype([('events', '<u4'), ('action', 'u1')])
+
+
+def _or_minus_one(value):
+    return -1 if value is None else value
+
+
+def encode_episode(names, events, decisions, return_):
+    """The bytes of the record of an episode, given the agent's
+    (observation, private) pairs, its (events seen, action) decisions and
+    the return"""
+    actor_ids = {name: i for i, name in enumerate(names)}
+    encoded_events = np.array(
+        [(observation.type.value,
+          actor_ids[observation.actor],
+          private,
+          _or_minus_one(observation.card),
+          _or_minus_one(observation.coins),
+          _or_minus_one(observation.turn))
+         for observation, private in events],
+        dtype=event_dtype)
+    encoded_decisions = np.array(
+        [(seen, action_codes[action]) for seen, action in decisions],
+        dtype=decision_dtype)
+    body = encoded_events.tobytes() + encoded_decisions.tobytes()
+    return _record_header.pack(_record_header.size + len(body),
+                               len(encoded_events),
+                               len(encoded_decisions),
+                               return_) + body
+
+
+class ReplayWriter:
+    """Appends episodes to a log, creating it if it does not exist. A
+    record left incomplete at the end of the log, e.g. by a run that was
+    killed while writing it, is truncated away first."""
+    def __init__(self, path, names=('epsilon', 'random')):
+        self.path = path
+        self.names = tuple(names)
+        self._file = open(path, 'ab')
+        if self._file.tell() < _file_header.size + _names_size:
+            self._file.truncate(0)
+            encoded_names = '\x1f'.join(self.names).encode('utf-8')
+            if len(encoded_names) > _names_size:
+                raise ValueError('Too many or too long player names')
+            self._file.write(_file_header.pack(MAGIC, VERSION, 0))
+            self._file.write(encoded_names.ljust(_names_size, b'\x00'))
+            return
+        log = ReplayLog(path)
+        names, end = log.names, log.end()
+        log.close()
+        if names != self.names:
+            self._file.close()
+            raise ValueError('{} holds episodes of other players'.format(path))
+        if end < self._file.tell():
+            self._file.truncate(end)
+
+    def append(self, events, decisions, return_):
+        self.write(encode_episode(self.names, events, decisions, return_))
+
+    def write(self, record):
+        """Append a record made by encode_episode, e.g. in a worker"""
+        self._file.write(record)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EpisodeRecorder:
+    """Collects encoded episodes in memory, for a worker process to send
+    to the process that writes the log"""
+    def __init__(self, names=('epsilon', 'random')):
+        self.names = tuple(names)
+        self.records = []
+
+    def append(self, events, decisions, return_):
+        self.records.append(
+            encode_episode(self.names, events, decisions, return_))
+
+
+class ReplayLog:
+    """Reads the episodes of a log through mmap"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = _file_header.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a replay log'.format(path))
+        if version != VERSION:
+            raise ValueError('Unsupported replay log version {}'.format(
+                version))
+        names = self._mmap[_file_header.size:
+                           _file_header.size + _names_size]
+        self.names = tuple(names.rstrip(b'\x00').decode('utf-8')
+                           .split('\x1f'))
+        self._start = _file_header.size + _names_size
+
+    def episodes(self):
+        """Yield the events and decisions arrays and the return of each
+        complete episode in the log"""
+        data = self._mmap
+        for offset, (length, event_count, decision_count,
+                     return_) in self._records():
+            events_at = offset + _record_header.size
+            decisions_at = events_at + event_count * event_dtype.itemsize
+            yield (np.frombuffer(data, event_dtype, event_count, events_at),
+                   np.frombuffer(data, decision_dtype, decision_count,
+                                 decisions_at),
+                   return_)
+
+    def end(self):
+        """The offset just after the last complete record"""
+        end = self._start
+        for offset, header in self._records():
+            end = offset + header[0]
+        return end
+
+    def _records(self):
+        data = self._mmap
+        offset = self._start
+        while offset + _record_header.size <= len(data):
+            header = _record_header.unpack_from(data, offset)
+            if header[0] < _record_header.size or (
+                    offset + header[0] > len(data)):
+                break
+            yield offset, header
+            offset += header[0]
+
+    def __len__(self):
+        return sum(1 for _ in self.episodes())
+
+    def observation(self, event):
+        """The observation and privacy flag of an event record"""
+        event_type = _event_types[event['type'] - 1]
+        card, coins, turn = (None if value == -1 else int(value)
+                             for value in (event['card'],
+                                           event['coins'],
+                                           event['turn']))
+        return (Observation(event_type, self.names[event['actor']],
+                            card, coins, turn),
+                bool(event['private']))
+
+    def close(self):
+        self._mmap.close()
+
+
+def decision_batches(log, projection, batch_size=10000):
+    """Yield (decisions, targets) batches of the (state, action) pairs of
+    the episodes in a log and their returns, with the state of a decision
+    being the projection of the latest observation before it, as in
+    player.AgentWithLatestObservationAsState. Each distinct event is only
+    projected once."""
+    project_event = getattr(projection, 'project_event', None)
+    states = {}
+    decisions, targets = [], []
+    for events, episode_decisions, return_ in log.episodes():
+        latest = episode_decisions['events'].astype(np.int64) - 1
+        keys = events.view(np.uint64)[latest].tolist()
+        for key, seen, code in zip(keys,
+                                   latest.tolist(),
+                                   episode_decisions['action'].tolist()):
+            if seen < 0:
+                S = ()
+            else:
+                S = states.get(key)
+                if S is None:
+                    observation, private = log.observation(events[seen])
+                    if project_event:
+                        S = project_event(observation, private)
+                    else:
+                        S = projection(
+                            render_observation(observation, private))
+                    states[key] = S
+            decisions.append((S, actions[code]))
+        targets.extend([return_] * len(episode_decisions))
+        if len(decisions) >= batch_size:
+            yield decisions, targets
+            decisions, targets = [], []
+    if decisions:
+        yield decisions, targets
+
+
+def refit(estimators, path, projection, batch_size=10000):
+    """Teach the estimators the returns of the decisions stored in a log,
+    and return the number of decisions learned from"""
+    log = ReplayLog(path)
+    learned = 0
+    for decisions, targets in decision_batches(log, projection, batch_size):
+        for estimator in estimators:
+            estimator.learn_batch(decisions, targets)
+        learned += len(decisions)
+    return learned
+
+
+if __name__ == '__main__':
+    from dominion import ignore_player_and_turn_projection
+    from estimators import TabularQEstimator
+    from learn import mc_evaluate
+    from player import RandomPlayer
+    from policy import Greedy, EpsilonSoft
+
+    command, path = sys.argv[1:3]
+    estimator = TabularQEstimator()
+    start = time.time()
+    if command == 'record':
+        games = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        with ReplayWriter(path) as replay, redirect_stdout(io.StringIO()):
+            mc_evaluate([estimator],
+                        EpsilonSoft(0.1, Greedy(estimator)),
+                        RandomPlayer(),
+                        games=games,
+                        games_between_stats=games,
+                        replay=replay)
+        print('recorded {} games in {:.2f}s, {} bytes'.format(
+            games, time.time() - start, os.path.getsize(path)))
+    else:
+        learned = refit([estimator], path, ignore_player_and_turn_projection)
+        print('learned from {} decisions in {:.2f}s, {} entries'.format(
+            learned, time.time() - start, len(estimator)))
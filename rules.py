@@ -0,0 +1,83 @@
+"""The language cards are defined in, and a compiler from card definitions
+to the tables the engines use while playing.
+
+Cards are declarative: a type, a cost, a list of effects and victory
+points. Rather than interpreting effects on every play and scanning the
+supply on every decision, the engines look cards up by id in a CardTables
+compiled once from the card list, and build each choice from the
+templates of a SupplyIndex compiled once per set of supply piles. Neither
+depends on how many cards are defined."""
+from collections import namedtuple
+from enum import Enum
+
+Card = namedtuple('card', 'name type cost effects vp')
+
+CardType = Enum('CardType', 'treasure victory action')
+
+EffectType = Enum('EffectType', 'coins cards actions buys')
+
+Effect = namedtuple('effect', 'type value')
+
+ChoiceType = Enum('ChoiceType', 'buy play end_turn play_treasures')
+
+# The sum of the values of each type of effect of a card
+CardEffects = namedtuple('CardEffects', 'coins cards actions buys')
+
+
+class CardTables:
+    """Properties of every card, indexed by card id, i.e. position in the
+    list of cards"""
+    def __init__(self, cards):
+        self.cards = cards
+        self.names = [card.name for card in cards]
+        self.ids = {card.name: i for i, card in enumerate(cards)}
+        self.costs = [card.cost for card in cards]
+        self.vp = [card.vp for card in cards]
+        self.effects = [
+            CardEffects(*(sum(effect.value
+                              for effect in card.effects
+                              if effect.type == effect_type)
+                          for effect_type in EffectType))
+            for card in cards]
+        self.coins = [effects.coins for effects in self.effects]
+        self.is_action = [card.type == CardType.action for card in cards]
+        self.treasure_ids = [i for i, card in enumerate(cards)
+                             if card.type == CardType.treasure]
+        self.action_ids = [i for i, card in enumerate(cards)
+                           if card.type == CardType.action]
+        self.play_actions = [(ChoiceType.play, name) for name in self.names]
+        self.buy_actions = [(ChoiceType.buy, name) for name in self.names]
+
+
+class SupplyIndex:
+    """Legal action templates for a game with the given supply piles.
+    treasure_plays and action_plays are the (card id, play action) pairs of
+    the playable cards in the game, and buys_at(spend) the (card id, buy
+    action) pairs of the piles that cost at most spend, all in card id
+    order. A card is played or bought if it is in hand, or its pile is not
+    empty."""
+    def __init__(self, tables, pile_ids):
+        self.pile_ids = sorted(pile_ids)
+        self.by_cost = sorted(self.pile_ids, key=tables.costs.__getitem__)
+        self.treasure_plays = [(card_id, tables.play_actions[card_id])
+                               for card_id in tables.treasure_ids
+                               if card_id in self.pile_ids]
+        self.action_plays = [(card_id, tables.play_actions[card_id])
+                             for card_id in tables.action_ids
+                             if card_id in self.pile_ids]
+        self.max_cost = max(tables.costs[card_id]
+                            for card_id in self.pile_ids)
+        self._buy_templates = []
+        affordable = 0
+        for spend in range(self.max_cost + 1):
+            while (affordable < len(self.by_cost)
+                   and tables.costs[self.by_cost[affordable]] <= spend):
+                affordable += 1
+            self._buy_templates.append(
+                [(card_id, tables.buy_actions[card_id])
+                 for card_id in sorted(self.by_cost[:affordable])])
+
+    def buys_at(self, spend):
+        if spend >= self.max_cost:
+            return self._buy_templates[-1]
+        return self._buy_templates[spend]
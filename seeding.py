@@ -0,0 +1,50 @@
+"""Independent random streams derived from a root seed.
+
+Every stream is a random.Random seeded from a numpy SeedSequence whose
+spawn key identifies the stream, e.g. the index of a game and the role
+of the component that draws from it. Streams for different keys are
+independent, and a stream only depends on the root seed and its key, so
+games can be played in any order or process and still be reproduced."""
+from collections import namedtuple
+import random
+
+import numpy as np
+
+GameStreams = namedtuple('GameStreams', 'game policy opponent')
+
+
+def stream(seed, *key):
+    """The random.Random for the stream identified by key"""
+    state = np.random.SeedSequence(seed, spawn_key=key).generate_state(
+        4, np.uint64)
+    return random.Random(int.from_bytes(state.tobytes(), 'little'))
+
+
+def game_streams(seed, game):
+    """Streams for the engine and seating, the policy and the opponent of
+    the game with the given index"""
+    return GameStreams(*(stream(seed, game, role) for role in range(3)))
+
+
+class GlobalRandom:
+    """Draws from the global random module. Players and policies use this
+    when no stream is given, as unlike the module it can be pickled, e.g.
+    to send them to worker processes, where it draws from their global
+    random module."""
+    def random(self):
+        return random.random()
+
+    def randrange(self, *args):
+        return random.randrange(*args)
+
+    def shuffle(self, x):
+        random.shuffle(x)
+
+    def sample(self, population, k):
+        return random.sample(population, k)
+
+    def getrandbits(self, k):
+        return random.getrandbits(k)
+
+
+global_random = GlobalRandom()
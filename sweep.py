@@ -0,0 +1,420 @@
+"""Hyperparameter sweeps of self play training.
+
+A sweep is described by a JSON spec, e.g.
+
+    {
+        "search": "random",
+        "trials": 12,
+        "seed": 0,
+        "parameters": {
+            "estimator": ["tabular", "capped"],
+            "epsilon": {"min": 0.02, "max": 0.3, "log": true},
+            "cap": {"min": 100, "max": 10000, "log": true, "integer": true},
+            "threshold": [0.6, 0.65, 0.7],
+            "projection": ["ignore_player_and_turn", "ignore_player"]
+        },
+        "fixed": {"eval_games": 1000},
+        "min_games": 2000,
+        "max_games": 18000,
+        "eta": 3
+    }
+
+With "search": "grid" every parameter is a list of values, and every
+combination is tried. With "random", "trials" configurations are drawn,
+from lists uniformly and from ranges uniformly or log-uniformly. Options
+an estimator does not take are dropped, so configurations that only differ
+in them are the same trial. block_games must be a multiple of
+games_between_stats.
+
+Trials are trained with learn.SelfPlayTrainer in a pool of worker
+processes, with a seed derived from the configuration. Trials are run with
+successive halving: all of them are trained for min_games games, and only
+the best 1 / eta of them continue, for eta times as many games, and so on
+up to max_games. A trial is scored by the win rate of its greedy policy
+against a random player, over the same eval_games games for every trial.
+
+Everything a trial produces is kept under the sweep directory, in a
+directory named by the hash of its configuration: the configuration, the
+metrics of every stats window, a checkpoint of the trainer and the score
+at every budget it was trained to. A trial is never trained to the same
+budget twice, and is continued from its checkpoint when trained further,
+so an interrupted sweep, or a sweep sharing trials with an earlier one, is
+resumed by running it again. A trial whose checkpoint is past the budget
+is trained again from the start, replacing its checkpoint and metrics.
+
+    python sweep.py spec.json [--directory results/sweeps] [--workers N]
+
+runs a sweep and prints a summary table of its trials."""
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from functools import partial
+from itertools import product
+from multiprocessing import Pool
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import pickle
+import time
+
+from dominion import (ignore_player_and_turn_projection,
+                      ignore_player_projection)
+from estimators import (TabularQEstimator, CappedTabularQEstimator,
+                        BoundedTabularQEstimator, LinearQEstimator)
+from learn import SelfPlayTrainer, mc_evaluate
+from player import RandomPlayer
+from policy import Greedy
+from seeding import stream
+from telemetry import MetricsWriter, read_metrics
+
+projections = OrderedDict([
+    ('ignore_player_and_turn', ignore_player_and_turn_projection),
+    ('ignore_player', ignore_player_projection),
+])
+
+# The options of each estimator that can be swept
+estimator_options = OrderedDict([
+    ('tabular', ()),
+    ('capped', ('cap',)),
+    ('bounded', ('max_entries',)),
+    ('linear', ('learning_rate',)),
+])
+
+defaults = OrderedDict([
+    ('estimator', 'tabular'),
+    ('cap', 1000),
+    ('max_entries', 100000),
+    ('learning_rate', 0.02),
+    ('epsilon', 0.1),
+    ('threshold', 0.65),
+    ('projection', 'ignore_player_and_turn'),
+    ('block_games', 5000),
+    ('games_between_stats', 1000),
+    ('test_games', 1000),
+    ('eval_games', 500),
+    ('engine_options', {}),
+])
+
+
+def normalise(config):
+    """The configuration with defaults filled in, and without the options
+    its estimator does not take"""
+    unknown = set(config) - set(defaults)
+    if unknown:
+        raise ValueError('Unknown sweep parameters: {}'.format(
+            ', '.join(sorted(unknown))))
+    normalised = OrderedDict(defaults)
+    normalised.update(config)
+    if normalised['estimator'] not in estimator_options:
+        raise ValueError('Unknown estimator: {}'.format(
+            normalised['estimator']))
+    if normalised['projection'] not in projections:
+        raise ValueError('Unknown projection: {}'.format(
+            normalised['projection']))
+    if normalised['block_games'] % normalised['games_between_stats']:
+        raise ValueError('block_games must be a multiple of '
+                         'games_between_stats')
+    for estimator, options in estimator_options.items():
+        for option in options:
+            if estimator != normalised['estimator']:
+                del normalised[option]
+    return normalised
+
+
+def config_hash(config, seed):
+    """Identifies the results of training a configuration with a seed"""
+    text = json.dumps({'config': config, 'seed': seed}, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def grid(parameters, fixed=None):
+    """Every combination of the values of the parameters"""
+    names = list(parameters)
+    configs = [dict(fixed or {}, **dict(zip(names, values)))
+               for values in product(*(parameters[name] for name in names))]
+    return _distinct(configs)
+
+
+def random_search(parameters, trials, rng, fixed=None):
+    """trials configurations with the parameters drawn at random, from a
+    list of values, or from a range given as a dict of min and max, and
+    optionally log and integer"""
+    configs = []
+    for _ in range(trials):
+        config = dict(fixed or {})
+        for name, values in parameters.items():
+            config[name] = _draw(values, rng)
+        configs.append(config)
+    return _distinct(configs)
+
+
+def _draw(values, rng):
+    if isinstance(values, list):
+        return values[rng.randrange(len(values))]
+    low, high = values['min'], values['max']
+    if values.get('log'):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    if values.get('integer'):
+        return int(round(value))
+    return value
+
+
+def _distinct(configs):
+    distinct = OrderedDict()
+    for config in configs:
+        normalised = normalise(config)
+        distinct[json.dumps(normalised, sort_keys=True)] = normalised
+    return list(distinct.values())
+
+
+# The key of the stream a bounded estimator samples evictions from. Keys
+# of the streams of games are pairs, so a single int does not collide
+EVICTION_STREAM = 0
+
+
+def make_estimator(config, seed=0):
+    estimator = config['estimator']
+    if estimator == 'capped':
+        return CappedTabularQEstimator(config['cap'])
+    if estimator == 'bounded':
+        return BoundedTabularQEstimator(max_entries=config['max_entries'],
+                                        rng=stream(seed, EVICTION_STREAM))
+    if estimator == 'linear':
+        return LinearQEstimator(learning_rate=config['learning_rate'])
+    return TabularQEstimator()
+
+
+def evaluate(estimator, config, seed):
+    """Win rate of the greedy policy of the estimator against a random
+    player, without learning. Estimators with a snapshot method are
+    evaluated through a snapshot, as predicting with TabularQEstimator
+    inserts entries for the pairs it has not seen."""
+    snapshot = getattr(estimator, 'snapshot', None)
+    if snapshot is not None:
+        estimator = snapshot()
+    stats = mc_evaluate([],
+                        Greedy(estimator),
+                        RandomPlayer(),
+                        games=config['eval_games'],
+                        games_between_stats=config['eval_games'],
+                        seed=seed,
+                        engine_options=config['engine_options'],
+                        projection=projections[config['projection']])
+    return stats[-1]['win_rate']
+
+
+def _trial_seed(key):
+    return int(key[:8], 16)
+
+
+def _read_rows(path):
+    if not os.path.exists(path):
+        return []
+    return list(read_metrics(path))
+
+
+def _keep_windows(path, windows):
+    """Drop the metrics rows written after the checkpoint was, by a trial
+    that was interrupted"""
+    rows = [row for row in _read_rows(path) if row['window'] < windows]
+    with open(path, 'w') as file:
+        for row in rows:
+            file.write(json.dumps(row) + '\n')
+
+
+def _save(path, value):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump(value, file)
+    os.replace(temporary, path)
+
+
+def _run_trial(task):
+    """Worker side of a sweep. Trains a trial to the given budget, unless
+    it already has been, and returns its key and the result row"""
+    directory, config, seed, games = task
+    key = config_hash(config, seed)
+    path = os.path.join(directory, key)
+    results_path = os.path.join(path, 'results.jsonl')
+    for row in _read_rows(results_path):
+        if row['budget'] == games:
+            return key, row
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'config.json'), 'w') as file:
+        json.dump({'config': config, 'seed': seed}, file, indent=2)
+    metrics_path = os.path.join(path, 'metrics.jsonl')
+    checkpoint_path = os.path.join(path, 'checkpoint.p')
+    trainer = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'rb') as file:
+            trainer = pickle.load(file)
+        if trainer.game > games:
+            # Trained further by an earlier sweep with other budgets. As
+            # training is seeded, training again from the start gets the
+            # same results, and the checkpoint and the metrics are
+            # replaced by those of the new run.
+            trainer = None
+    if trainer is None:
+        if os.path.exists(metrics_path):
+            os.remove(metrics_path)
+        trainer = SelfPlayTrainer(
+            partial(make_estimator, config, _trial_seed(key)),
+            epsilon=config['epsilon'],
+            threshold=config['threshold'],
+            projection=projections[config['projection']],
+            block_games=config['block_games'],
+            games_between_stats=config['games_between_stats'],
+            test_games=config['test_games'],
+            seed=_trial_seed(key),
+            metrics=MetricsWriter(metrics_path),
+            engine_options=config['engine_options'])
+    else:
+        trainer.metrics.path = metrics_path
+        _keep_windows(metrics_path, trainer.metrics._windows)
+    start = time.time()
+    with redirect_stdout(io.StringIO()):
+        trainer.train(games)
+        score = evaluate(trainer.acting_estimator, config, seed)
+    _save(checkpoint_path, trainer)
+    row = OrderedDict([('budget', games),
+                       ('games', trainer.game),
+                       ('generation', trainer.generation),
+                       ('score', score),
+                       ('seconds', time.time() - start)])
+    with open(results_path, 'a') as file:
+        file.write(json.dumps(row) + '\n')
+    return key, row
+
+
+class Sweep:
+    """Runs trials of configurations under a directory, keeping the
+    latest result of each"""
+    def __init__(self, directory, seed=0, workers=None):
+        self._directory = directory
+        self._seed = seed
+        self._workers = workers
+        self.configs = OrderedDict()
+        self.results = OrderedDict()
+
+    def run(self, configs, games):
+        """Train the configurations to games games each, and return their
+        keys, best scoring first"""
+        tasks = []
+        for config in configs:
+            self.configs[config_hash(config, self._seed)] = config
+            tasks.append((self._directory, config, self._seed, games))
+        os.makedirs(self._directory, exist_ok=True)
+        with Pool(self._workers) as pool:
+            for key, row in pool.imap_unordered(_run_trial, tasks):
+                self.results[key] = row
+                print('{} {} games, score {:.3f}'.format(
+                    key, row['games'], row['score']))
+        keys = [config_hash(config, self._seed) for config in configs]
+        return sorted(keys, key=lambda key: self.results[key]['score'],
+                      reverse=True)
+
+    def successive_halving(self, configs, min_games, max_games, eta=3):
+        """Train all configurations for min_games games, then keep training
+        the best 1 / eta of them for eta times as many games, until only
+        one is left or max_games is reached. Returns the keys of the
+        configurations of the last round, best first."""
+        budget = min_games
+        while True:
+            ranked = self.run(configs, budget)
+            if budget >= max_games or len(configs) == 1:
+                return ranked
+            survivors = set(ranked[:max(1, len(configs) // eta)])
+            configs = [config for config in configs
+                       if config_hash(config, self._seed) in survivors]
+            budget = min(budget * eta, max_games)
+
+    def summary(self):
+        """A row per trial run, combining its latest result with the stats
+        windows streamed to its metrics file, best scoring first"""
+        varying = [name for name in defaults
+                   if len(set(json.dumps(config.get(name))
+                              for config in self.configs.values())) > 1]
+        rows = []
+        for key, result in self.results.items():
+            windows = games = 0
+            latest = None
+            for latest in read_metrics(
+                    os.path.join(self._directory, key, 'metrics.jsonl')):
+                windows += 1
+                games = latest['game'] + latest['games']
+            row = OrderedDict([('trial', key)])
+            for name in varying:
+                row[name] = self.configs[key].get(name)
+            row['games'] = games
+            row['generation'] = result['generation']
+            row['rolling_win_rate'] = (latest['rolling_win_rate']
+                                       if latest else None)
+            row['average_turns'] = latest['average_turns'] if latest else None
+            row['score'] = result['score']
+            rows.append(row)
+        return sorted(rows, key=lambda row: row['score'], reverse=True)
+
+    def report(self):
+        rows = self.summary()
+        if not rows:
+            return
+        columns = list(rows[0])
+        cells = [[_format(row[column]) for column in columns] for row in rows]
+        widths = [max(len(column), *(len(line[i]) for line in cells))
+                  for i, column in enumerate(columns)]
+        print('  '.join(column.ljust(width)
+                        for column, width in zip(columns, widths)))
+        for line in cells:
+            print('  '.join(cell.ljust(width)
+                            for cell, width in zip(line, widths)))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.3f}'.format(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def load_spec(path):
+    """The seed, the configurations and the successive halving options
+    of a sweep spec"""
+    with open(path) as file:
+        spec = json.load(file)
+    seed = spec.get('seed', 0)
+    parameters = spec.get('parameters', {})
+    fixed = spec.get('fixed', {})
+    search = spec.get('search', 'grid')
+    if search == 'grid':
+        configs = grid(parameters, fixed)
+    elif search == 'random':
+        configs = random_search(parameters, spec['trials'], stream(seed),
+                                fixed)
+    else:
+        raise ValueError('Unknown search: {}'.format(search))
+    max_games = spec.get('max_games', 10000)
+    return (seed,
+            configs,
+            spec.get('min_games', max_games),
+            max_games,
+            spec.get('eta', 3))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec')
+    parser.add_argument('--directory', default='results/sweeps')
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+    # Run from the module rather than __main__, so that the checkpoints
+    # refer to it by name and can be loaded elsewhere
+    import sweep
+    seed, configs, min_games, max_games, eta = sweep.load_spec(args.spec)
+    runner = sweep.Sweep(args.directory, seed, args.workers)
+    runner.successive_halving(configs, min_games, max_games, eta)
+    runner.report()
@@ -0,0 +1,151 @@
+"""Constant memory training metrics. Statistics are kept as running
+accumulators, and one row per stats window is appended to a JSONL or CSV
+file as training progresses, so that a run can be plotted while it is
+going, or after it has crashed.
+
+    python telemetry.py results/learning-metrics-<timestamp>.jsonl [out.png]
+
+renders the plot of a metrics file."""
+from collections import OrderedDict, deque
+import csv
+import json
+import math
+import os
+import sys
+import time
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of values (Welford's method)"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self._m2 += (other._m2
+                     + delta * delta * self.count * other.count / count)
+        self.mean += delta * other.count / count
+        self.count = count
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class RollingMean:
+    """Mean of the latest window_count values"""
+    def __init__(self, window_count):
+        self._values = deque(maxlen=window_count)
+
+    def add(self, value):
+        self._values.append(value)
+
+    def mean(self):
+        if not self._values:
+            return 0.0
+        return sum(self._values) / len(self._values)
+
+
+class MetricsWriter:
+    """Appends one row per stats window to a JSONL file, or a CSV file if
+    the path ends with .csv. Each row gets the index of the window, the
+    number of games played before it in the whole run, the rolling win
+    rate over the latest rolling_windows windows and any fields set in
+    context, e.g. the generation of the opponent."""
+    def __init__(self, path, rolling_windows=5):
+        self.path = path
+        self.context = OrderedDict()
+        self._csv = path.endswith('.csv')
+        self._fieldnames = None
+        self._windows = 0
+        self._games = 0
+        self._rolling_win_rate = RollingMean(rolling_windows)
+
+    def write_window(self, summary):
+        self._rolling_win_rate.add(summary['win_rate'])
+        row = OrderedDict([
+            ('window', self._windows),
+            ('game', self._games),
+            ('time', time.time()),
+        ])
+        row.update(self.context)
+        row.update(summary)
+        row['rolling_win_rate'] = self._rolling_win_rate.mean()
+        self._windows += 1
+        self._games += summary['games']
+        with open(self.path, 'a', newline='') as file:
+            if self._csv:
+                if self._fieldnames is None:
+                    self._fieldnames = list(row.keys())
+                writer = csv.DictWriter(file,
+                                        fieldnames=self._fieldnames,
+                                        extrasaction='ignore')
+                if not file.tell():
+                    writer.writeheader()
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(row) + '\n')
+        return row
+
+
+def read_metrics(path):
+    """Stream the rows of a metrics file"""
+    with open(path, newline='') as file:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(file):
+                yield {key: _number(value) for key, value in row.items()}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def plot_metrics(path, output=None):
+    """Render the turns, winning score and win rate of a metrics file"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    games, turns, scores, win_rates = [], [], [], []
+    for row in read_metrics(path):
+        games.append(row['game'])
+        turns.append(row['average_turns'])
+        scores.append(row['average_score'])
+        win_rates.append(row['win_rate'] * 100)
+    if output is None:
+        output = os.path.splitext(path)[0] + '.png'
+    figure = plt.figure()
+    plt.plot(games, turns, label='turns')
+    plt.plot(games, scores, label='winning score')
+    plt.plot(games, win_rates, label='win rate')
+    plt.xlabel('game')
+    plt.legend()
+    plt.savefig(output)
+    plt.close(figure)
+    return output
+
+
+if __name__ == '__main__':
+    print(plot_metrics(*sys.argv[1:3]))
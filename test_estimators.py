@@ -0,0 +1,81 @@
+"""Tests that the batched and merged updates of the estimators learn the
+same values as learning one target at a time"""
+import random
+
+import pytest
+
+from estimators import (ArrayTabularQEstimator, BoundedTabularQEstimator,
+                        CappedTabularQEstimator, TabularQEstimator,
+                        TargetRuns, _estimator_items)
+
+
+def _games(count=40, seed=0):
+    """Decisions and returns of made up games, with pairs that recur
+    within and across games, so that counts go past small caps"""
+    rng = random.Random(seed)
+    pairs = [('state {}'.format(state), ('buy', action))
+             for state in range(6) for action in range(3)]
+    return [([rng.choice(pairs) for _ in range(rng.randrange(1, 30))],
+             rng.choice((-1, 1)))
+            for _ in range(count)]
+
+
+def _entries(estimator):
+    return dict(_estimator_items(estimator))
+
+
+def _assert_same_entries(actual, expected):
+    assert actual.keys() == expected.keys()
+    for s_a, (n, q) in expected.items():
+        assert actual[s_a][0] == n
+        assert actual[s_a][1] == pytest.approx(q, rel=0, abs=1e-12)
+
+
+@pytest.mark.parametrize('make_estimator', [
+    TabularQEstimator,
+    lambda: CappedTabularQEstimator(5),
+    ArrayTabularQEstimator,
+    lambda: BoundedTabularQEstimator(max_entries=1000),
+])
+def test_learn_batch_matches_learning_one_target_at_a_time(make_estimator):
+    serial = make_estimator()
+    batched = make_estimator()
+    for decisions, return_ in _games():
+        targets = [return_ if i % 3 else 0.5 * return_
+                   for i in range(len(decisions))]
+        for (S, A), target in zip(decisions, targets):
+            serial.learnFrom(S, A, target)
+        batched.learn_batch(decisions, targets)
+    _assert_same_entries(_entries(batched), _entries(serial))
+
+
+@pytest.mark.parametrize('cap', [1, 5, 1000])
+def test_capped_merge_of_target_runs_matches_serial_learning(cap):
+    games = _games()
+    serial = CappedTabularQEstimator(cap)
+    for decisions, return_ in games:
+        for S, A in decisions:
+            serial.learnFrom(S, A, return_)
+    merged = CappedTabularQEstimator(cap)
+    for start in range(0, len(games), 10):
+        partial = TargetRuns()
+        for decisions, return_ in games[start:start + 10]:
+            partial.learn_batch(decisions, [return_] * len(decisions))
+        merged.merge(partial)
+    _assert_same_entries(_entries(merged), _entries(serial))
+
+
+def test_array_estimator_matches_tabular_estimator():
+    games = _games()
+    array_estimator = ArrayTabularQEstimator(capacity=4)
+    tabular = TabularQEstimator()
+    for decisions, return_ in games:
+        array_estimator.learn_batch(decisions, [return_] * len(decisions))
+        for S, A in decisions:
+            tabular.learnFrom(S, A, return_)
+    _assert_same_entries(_entries(array_estimator), _entries(tabular))
+    actions = [('buy', action) for action in range(4)]
+    for state in range(7):
+        S = 'state {}'.format(state)
+        assert list(array_estimator.predict_many(S, actions)) == [
+            pytest.approx(tabular.predict(S, A), abs=1e-12) for A in actions]
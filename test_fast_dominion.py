@@ -0,0 +1,154 @@
+"""Differential tests of fast_dominion against the reference engine in
+dominion.py"""
+from collections import OrderedDict
+import random
+
+import pytest
+
+import fast_dominion
+from dominion import (GameState as ReferenceGameState, cards,
+                      render_observation)
+from game import Game
+from player import RandomPlayer
+from rules import CardType
+
+kingdom = [card.name for card in cards if card.type == CardType.action]
+
+
+def _visible_summary(state):
+    """The parts of a fast GameState that must agree with the reference
+    engine after the same transition, regardless of the cards drawn"""
+    return (
+        state._turn,
+        state._active_player_idx,
+        tuple(state._supply),
+        tuple((player._to_spend,
+               player._buys,
+               player._actions,
+               sum(player._hand),
+               tuple(player._played),
+               tuple(player.get_all_counts()))
+              for player in state._players))
+
+
+def compare_with_reference(games=100, seed=0, **options):
+    """Differential test against dominion.GameState. Plays random games on
+    the reference engine and, before every transition, rebuilds an
+    equivalent fast state and applies the same choice to both. Draws are
+    random in both engines, so everything except the identity of the
+    cards drawn is compared. Treasures played automatically at the start
+    of a turn depend on the cards drawn, so with engine options only the
+    transitions within a turn are compared in full. Returns the number of
+    transitions checked."""
+    random.seed(seed)
+    checked = 0
+    for _ in range(games):
+        reference = ReferenceGameState(['alice', 'bob'], **options)
+        _, choice = reference.get_first_choice()
+        while not reference.is_game_over():
+            fast = fast_dominion.GameState.from_reference(reference)
+            fast_choice = fast._purchase_or_play_treasure_choice(
+                fast._active_player())
+            assert set(fast_choice.alternatives) == set(choice.alternatives), (
+                fast_choice, choice)
+            assert fast_choice.player == choice.player
+            state_turn_and_player = (fast._turn, fast._active_player_idx)
+            chosen = random.choice(choice.alternatives)
+            reference_observations, choice = reference.get_next_choice(chosen)
+            fast_observations, _ = fast.get_next_choice(chosen)
+            after = fast_dominion.GameState.from_reference(reference)
+            if options and (fast._turn, fast._active_player_idx) != (
+                    state_turn_and_player):
+                assert fast._supply == after._supply, chosen
+                assert (fast._turn, fast._active_player_idx) == (
+                    after._turn, after._active_player_idx)
+                checked += 1
+                continue
+            assert _visible_summary(fast) == _visible_summary(after), chosen
+            assert ([render_observation(o, False) for o in fast_observations]
+                    == [render_observation(o, False)
+                        for o in reference_observations])
+            assert fast.is_game_over() == reference.is_game_over()
+            checked += 1
+        fast = fast_dominion.GameState.from_reference(reference)
+        assert fast.get_winner() == reference.get_winner()
+    return checked
+
+
+def _piles(state):
+    return (state._turn,
+            state._active_player_idx,
+            state._supply,
+            [(player._deck, player._hand, player._played, player._discard)
+             for player in state._players])
+
+
+def check_clones(games=20, seed=0, **options):
+    """Plays random games, and at every decision checks that a clone with
+    the same random stream as the game plays out identically, and that a
+    determinized clone keeps everything its owner can see. Returns the
+    number of clones checked."""
+    rng = random.Random(seed)
+    checked = 0
+    for _ in range(games):
+        state = fast_dominion.GameState(['alice', 'bob'],
+                                        random.Random(rng.random()),
+                                        **options)
+        _, choice = state.get_first_choice()
+        while not state.is_game_over():
+            chosen = choice.alternatives[
+                rng.randrange(len(choice.alternatives))]
+            twin_rng = random.Random()
+            twin_rng.setstate(state._rng.getstate())
+            twin = state.clone(twin_rng)
+            assert twin.get_choice() == choice
+            observations, choice = state.get_next_choice(chosen)
+            twin_observations, twin_choice = twin.get_next_choice(chosen)
+            assert twin_observations == observations
+            assert twin_choice == choice
+            assert _piles(twin) == _piles(state)
+            if not state.is_game_over():
+                viewer = state._active_player()._name
+                determinized = state.clone(determinize_for=viewer)
+                for player, other in zip(state._players,
+                                         determinized._players):
+                    assert player.get_all_counts() == other.get_all_counts()
+                    assert sum(player._hand) == sum(other._hand)
+                    if player._name == viewer:
+                        assert player._hand == other._hand
+                assert determinized.get_choice() == choice
+            checked += 1
+    return checked
+
+
+def test_transitions_agree_with_reference():
+    assert compare_with_reference(10) > 0
+
+
+@pytest.mark.parametrize('treasures', ['auto', 'macro'])
+def test_transitions_agree_with_treasure_options(treasures):
+    assert compare_with_reference(10, treasures=treasures,
+                                  skip_forced=True) > 0
+
+
+def test_transitions_agree_with_kingdom():
+    assert compare_with_reference(10, kingdom=kingdom) > 0
+
+
+@pytest.mark.parametrize('options', [{}, {'kingdom': kingdom}])
+def test_clones_agree_with_originals(options):
+    assert check_clones(4, **options) > 0
+
+
+def test_plays_games_through_game():
+    for seed in range(5):
+        players = OrderedDict([
+            ('alice', RandomPlayer(rng=random.Random(seed))),
+            ('bob', RandomPlayer(rng=random.Random(-seed))),
+        ])
+        game = Game(players, engine=fast_dominion, headless=True,
+                    rng=random.Random(seed))
+        game.play()
+        stats = game.get_stats()
+        assert stats.winner in players
+        assert game.get_scores()[stats.winner] == stats.score
@@ -0,0 +1,9 @@
+"""Tests of the self play training loop"""
+import pytest
+
+from learn import SelfPlayTrainer
+
+
+def test_blocks_must_be_whole_stats_windows():
+    with pytest.raises(ValueError, match='multiple'):
+        SelfPlayTrainer(block_games=30, games_between_stats=20, seed=1)
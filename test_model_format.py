@@ -0,0 +1,30 @@
+"""Tests that model files round trip tabular estimators and refuse others"""
+import pytest
+
+import model_format
+from estimators import LinearQEstimator, TabularQEstimator
+from rules import ChoiceType
+
+buy_copper = (ChoiceType.buy, 'Copper')
+end_turn = (ChoiceType.end_turn,)
+
+
+def test_saved_table_predicts_like_the_estimator(tmp_path):
+    estimator = TabularQEstimator()
+    estimator.learn_batch([('a b', buy_copper), ('a b', end_turn),
+                           ('c', buy_copper)], [1, -1, 0.5])
+    path = str(tmp_path / 'model.qtab')
+    model_format.save(estimator, path)
+    mapped = model_format.MappedQEstimator(path)
+    for S in ('a b', 'c', 'd'):
+        for A in (buy_copper, end_turn):
+            assert mapped.predict(S, A) == estimator.predict(S, A)
+
+
+def test_linear_estimator_is_refused(tmp_path):
+    estimator = LinearQEstimator(features=16)
+    estimator.learnFrom('a b', buy_copper, 1.0)
+    with pytest.raises(TypeError, match='LinearQEstimator'):
+        model_format.save(estimator, str(tmp_path / 'model.qtab'))
+    with pytest.raises(TypeError, match='LinearQEstimator'):
+        TabularQEstimator().merge(estimator)
@@ -0,0 +1,60 @@
+"""Tests that projecting structured events directly gives the same states
+as rendering them and projecting the text"""
+import random
+
+import pytest
+
+import fast_dominion
+from dominion import (cards, ignore_player_and_turn_projection,
+                      ignore_player_projection, render_observation)
+from projection import MemoizedProjection, RegexProjection
+from rules import CardType
+
+kingdom = [card.name for card in cards if card.type == CardType.action]
+
+
+def _events(games=3, seed=0):
+    rng = random.Random(seed)
+    events = set()
+    for _ in range(games):
+        state = fast_dominion.GameState(['epsilon', 'random'],
+                                        random.Random(rng.random()),
+                                        kingdom=kingdom)
+        observations, choice = state.get_first_choice()
+        while not state.is_game_over():
+            for observation in observations:
+                events.add((observation, True))
+                events.add((observation, False))
+            chosen = choice.alternatives[
+                rng.randrange(len(choice.alternatives))]
+            observations, choice = state.get_next_choice(chosen)
+    return events
+
+
+@pytest.mark.parametrize('projection', [ignore_player_and_turn_projection,
+                                        ignore_player_projection])
+def test_event_projection_matches_text_projection(projection):
+    events = _events()
+    assert events
+    for observation, private in events:
+        text = render_observation(observation, private)
+        assert (projection._event_projection(observation, private)
+                == projection._projection(text))
+
+
+def test_composed_event_projection_matches_text_projection():
+    drop_coins = RegexProjection([(r' \d+ coins', ' coins')])
+    composed = ignore_player_and_turn_projection.then(drop_coins)
+    for observation, private in _events(1):
+        text = render_observation(observation, private)
+        assert (composed.project_event(observation, private)
+                == composed(text))
+
+
+def test_cache_counts_hits_and_misses():
+    projection = MemoizedProjection(
+        RegexProjection([(r'a', 'b')]), render=render_observation)
+    assert projection('aa') == 'bb'
+    assert projection('aa') == 'bb'
+    assert projection.cache_info()['hits'] == 1
+    assert projection.cache_info()['misses'] == 1
@@ -0,0 +1,34 @@
+"""Tests that a replay log survives a run killed while appending to it"""
+import io
+import os
+from contextlib import redirect_stdout
+
+from estimators import TabularQEstimator
+from learn import mc_evaluate
+from player import RandomPlayer
+from policy import EpsilonSoft, Greedy
+from replay import ReplayLog, ReplayWriter
+
+
+def _record(writer, games):
+    estimator = TabularQEstimator()
+    with redirect_stdout(io.StringIO()):
+        mc_evaluate([estimator], EpsilonSoft(0.1, Greedy(estimator)),
+                    RandomPlayer(), games=games, games_between_stats=games,
+                    replay=writer)
+
+
+def test_writer_truncates_torn_record(tmp_path):
+    path = str(tmp_path / 'episodes.log')
+    writer = ReplayWriter(path)
+    _record(writer, 5)
+    assert len(ReplayLog(path)) == 5
+    writer.close()
+    with open(path, 'r+b') as log:
+        log.truncate(os.path.getsize(path) - 3)
+    assert len(ReplayLog(path)) == 4
+    with ReplayWriter(path) as writer:
+        _record(writer, 2)
+    log = ReplayLog(path)
+    assert len(log) == 6
+    assert log.end() == os.path.getsize(path)
@@ -0,0 +1,79 @@
+"""Tests that seeded runs do not depend on anything but the seed"""
+from collections import OrderedDict
+import os
+import random
+import subprocess
+import sys
+
+import fast_dominion
+from game import Game
+from player import RandomPlayer, RolloutPlayer
+
+_run = '''
+import hashlib, io, random
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import dominion
+from estimators import TabularQEstimator
+from game import Game
+from learn import mc_evaluate
+from player import RandomPlayer
+from policy import Greedy, EpsilonSoft
+
+results = []
+for seed in range(3):
+    players = OrderedDict([
+        ('alice', RandomPlayer(rng=random.Random(seed))),
+        ('bob', RandomPlayer(rng=random.Random(-seed))),
+    ])
+    game = Game(players, engine=dominion, headless=True,
+                rng=random.Random(seed))
+    output = io.StringIO()
+    with redirect_stdout(output):
+        game.play()
+        game.game_state.print_result()
+    results.append((game.get_scores(), game.get_stats(), output.getvalue()))
+estimator = TabularQEstimator()
+with redirect_stdout(io.StringIO()):
+    results.append(mc_evaluate([estimator],
+                               EpsilonSoft(0.1, Greedy(estimator)),
+                               RandomPlayer(),
+                               games=40,
+                               games_between_stats=20,
+                               seed=7))
+results.append(sorted(map(repr, estimator._q_estimates.items())))
+print(hashlib.sha1(repr(results).encode()).hexdigest())
+'''
+
+
+def _digest(hash_seed):
+    environment = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    return subprocess.run([sys.executable, '-c', _run],
+                          cwd=os.path.dirname(os.path.abspath(__file__)),
+                          env=environment,
+                          capture_output=True,
+                          text=True,
+                          check=True).stdout
+
+
+def test_seeded_runs_do_not_depend_on_the_hash_seed():
+    assert _digest(1) == _digest(2) == _digest(3)
+
+
+def _rollout_game():
+    players = OrderedDict([
+        ('alice', RolloutPlayer(playouts=1, time_budget=60)),
+        ('bob', RandomPlayer()),
+    ])
+    game = Game(players, engine=fast_dominion, headless=True,
+                rng=random.Random(1))
+    game.play()
+    return game.get_scores(), game.get_stats()
+
+
+def test_rollout_player_draws_from_the_global_random_module():
+    results = []
+    for _ in range(2):
+        random.seed(5)
+        results.append(_rollout_game())
+    assert results[0] == results[1]
@@ -0,0 +1,26 @@
+"""Tests of the configurations of sweeps"""
+import pytest
+
+import sweep
+
+
+@pytest.mark.parametrize('estimator', list(sweep.estimator_options))
+def test_every_estimator_can_be_made(estimator):
+    config = sweep.normalise({'estimator': estimator})
+    made = sweep.make_estimator(config, sweep._trial_seed('0123abcd'))
+    made.learnFrom('state', ('buy', 'copper'), 1.0)
+    assert made.predict('state', ('buy', 'copper')) > 0
+
+
+def test_blocks_must_be_whole_stats_windows():
+    with pytest.raises(ValueError, match='multiple'):
+        sweep.normalise({'block_games': 30, 'games_between_stats': 20})
+
+
+def test_evaluation_leaves_the_estimator_as_it_is():
+    config = sweep.normalise({'eval_games': 5})
+    estimator = sweep.make_estimator(config)
+    estimator.learnFrom('state', ('buy', 'copper'), 1.0)
+    sweep.evaluate(estimator, config, seed=0)
+    assert len(estimator) == 1
+    sweep.evaluate(estimator.snapshot(), config, seed=0)